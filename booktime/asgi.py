@@ -2,6 +2,8 @@
 ASGI config for booktime project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django, served from a thread pool by ThreadPoolASGIHandler,
+WebSocket connections are routed by Channels.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -9,8 +11,22 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+from booktime.handlers import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'booktime.settings')
 
-application = get_asgi_application()
+# Django has to be set up before the routing imports the consumers and models
+django_asgi_application = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+
+import main.routing
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_application,
+    'websocket': AllowedHostsOriginValidator(
+        AuthMiddlewareStack(URLRouter(main.routing.websocket_urlpatterns))
+    ),
+})
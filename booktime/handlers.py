@@ -0,0 +1,75 @@
+"""ASGI handler running the views in a pool of threads.
+
+Django 3.0 has no async views, its ASGIHandler runs the whole middleware and
+view chain with sync_to_async. Since asgiref 3.3 that defaults to
+thread_sensitive=True, so every request of a worker runs in the same single
+thread, one after the other. ThreadPoolASGIHandler runs each request in a pool
+of settings.ASGI_THREADS threads instead, each holding its own database
+connection, so a worker serves as many requests at once as it has threads.
+When queries return instantly, as on a local SQLite file, the pool is slower
+than the stock handler, see the benchmark_asgi command
+"""
+
+import django
+from django.conf import settings
+from django.core import signals
+from django.core.exceptions import RequestAborted
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from django.http import FileResponse
+from django.urls import set_script_prefix
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import functools
+
+_executor = None
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.ASGI_THREADS, thread_name_prefix="asgi")
+    return _executor
+
+
+class ThreadPoolASGIHandler(ASGIHandler):
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise ValueError(f"Django can only handle ASGI/HTTP connections, not {scope['type']}.")
+        try:
+            body_file = await self.read_body(receive)
+        except RequestAborted:
+            return
+
+        loop = asyncio.get_running_loop()
+        # The context is copied so the request sees the context variables of the caller
+        context = contextvars.copy_context()
+        response = await loop.run_in_executor(
+            get_executor(), functools.partial(context.run, self.get_response_in_thread, scope, body_file)
+        )
+        response._handler_class = self.__class__
+        if isinstance(response, FileResponse):
+            response.block_size = self.chunk_size
+        await self.send_response(response, send)
+
+    def get_response_in_thread(self, scope, body_file):
+        """request_started closes the stale connections of the thread it runs in,
+            and the script prefix is local to a thread, so both have to be set
+            in the thread handling the request"""
+        set_script_prefix(self.get_script_prefix(scope))
+        signals.request_started.send(sender=self.__class__, scope=scope)
+        request, error_response = self.create_request(scope, body_file)
+        if request is None:
+            return error_response
+        response = self.get_response(request)
+        # response.close() runs on the event loop, away from this thread's connection.
+        # Streaming responses are iterated there as well, so this one is done with
+        close_old_connections()
+        return response
+
+
+def get_asgi_application():
+    """Like django.core.asgi.get_asgi_application, with ThreadPoolASGIHandler"""
+    django.setup(set_prefix=False)
+    return ThreadPoolASGIHandler()
@@ -1,14 +1,15 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
 from django.utils.html import format_html
-from django.db.models.functions import TruncDay
-from django.db.models import Avg, Count, Min, Sum
+from django.db.models import Avg, Min, Sum
 from django.urls import path
 from django.template.response import TemplateResponse
 from django import forms
 from django.shortcuts import get_object_or_404, render
-from django.http import HttpResponse
-from django.template.loader import render_to_string
+from django.http import FileResponse
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 
 
 from .models import (Product, 
@@ -19,10 +20,13 @@ from .models import (Product,
                     Basket,
                     OrderLine,
                     Order,
-                    Address)
+                    Address,
+                    DailyOrderCount,
+                    DailyProductSales,
+                    deferred_order_rollup)
+from . import catalog_cache, invoices
+from .db_router import replica_reads
 
-import tempfile
-from weasyprint import HTML
 from datetime import datetime, timedelta
 import logging
 
@@ -76,11 +80,16 @@ class AddressAdmin(admin.ModelAdmin):
     readonly_fields = ("user", )
 
 def make_active(self, request, queryset):
+    # Read before the update, a changelist filtered on active would select nothing after it
+    product_ids = list(queryset.values_list("pk", flat=True))
     queryset.update(active=True)
+    catalog_cache.invalidate_products(product_ids) # update() doesn't send the signals that invalidate the listings
 make_active.short_description = "Mark selected items as active"
 
 def make_inactive(self, request, queryset):
+    product_ids = list(queryset.values_list("pk", flat=True))
     queryset.update(active=False)
+    catalog_cache.invalidate_products(product_ids)
 make_inactive.short_description = (
     "Mark selected items as inactive"
 )
@@ -129,14 +138,15 @@ class ProductTagAdmin(admin.ModelAdmin):
             return {}
 
 class ProductImageAdmin(admin.ModelAdmin):
-    list_display = ('thumbnail_tag', 'product_name')
-    readonly_fields = ('thumbnail',)
+    list_display = ('thumbnail_tag', 'product_name', 'thumbnail_status')
+    list_filter = ('thumbnail_status',)
+    readonly_fields = ('thumbnail', 'thumbnail_status')
     search_fields = ('product__name',)
     
     def thumbnail_tag(self, obj):
         if obj.thumbnail:
             return format_html(f"<img src='{obj.thumbnail.url}'/>")
-        return '-'
+        return obj.get_thumbnail_status_display()
     
     thumbnail_tag.short_description = "Thumbnail"
 
@@ -149,7 +159,7 @@ class BasketLineInline(admin.TabularInline):
 
 @admin.register(Basket)
 class BasketAdmin(admin.ModelAdmin):
-    list_display = ("id","user","status","count")
+    list_display = ("id","user","status","item_count","subtotal")
     list_editable = ('status',)
     list_filter = ('status',)
     inlines = (BasketLineInline,)
@@ -158,8 +168,15 @@ class OrderLineInline(admin.TabularInline):
     model = OrderLine
     raw_id_fields = ("product",)
 
+class OrderLineRollupMixin:
+    """Saving the order lines inline rolls the order status up once for the
+        whole formset instead of once per changed line"""
+    def save_related(self, request, form, formsets, change):
+        with deferred_order_rollup():
+            super().save_related(request, form, formsets, change)
+
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(OrderLineRollupMixin, admin.ModelAdmin):
     list_display = ("id","user","status")
     list_editable = ('status',)
     list_filter = ('status',"shipping_country", "date_added")
@@ -199,7 +216,7 @@ class CentralOfficeOrderLineInLine(admin.TabularInline):
     model = OrderLine
     readonly_fields = ("product",)
 
-class CentralOfficeOrderAdmin(admin.ModelAdmin):
+class CentralOfficeOrderAdmin(OrderLineRollupMixin, admin.ModelAdmin):
     list_display = ("id", "user", "status")
     list_editable = ("status",)
     readonly_fields = ("user",)
@@ -238,7 +255,7 @@ class CentralOfficeOrderAdmin(admin.ModelAdmin):
     )
     
 
-class DispatchersOrderAdmin(admin.ModelAdmin):
+class DispatchersOrderAdmin(OrderLineRollupMixin, admin.ModelAdmin):
     list_display = ("id", "shipping_name", "date_added", "status",)
     list_filter = ("status", "shipping_country", "date_added",)
     inlines = (CentralOfficeOrderLineInLine,)
@@ -287,54 +304,44 @@ class ReportingColoredAdminSite(ColoredAdminSite):
 
         return extra_urls + urls
 
-    """Creates a temporary/annotated day field, populating it
-        with data based on the date_added field
-        • Uses the new day field as a unit for aggregation
-        • Counts orders for specific days
-        The query includes two annotate() calls. The first acts on all
-        rows in the order table. The second, instead of acting on all rows, acts on
-        the result of the GROUP BY clause, which is generated by the values() call.
-        
-        SELECT DATE_TRUNC('day', "main_order"."date_added" AT TIME ZONE
-        'UTC') AS "day",
-            COUNT("main_order"."id") AS "c" FROM "main_order"
-             WHERE "main_order"."date_added" > 2018-01-16
-        19:20:01.262472+00:00
-            GROUP BY DATE_TRUNC('day', "main_order"."date_added" AT
-        TIME ZONE 'UTC')"""
+    """Both reports read the daily rollup tables (DailyOrderCount and
+        DailyProductSales), which are maintained as orders are created, so
+        their cost depends on the number of days and not on the number of orders"""
+    @replica_reads()
     def orders_per_day(self, request):
         starting_day = datetime.now() - timedelta(days=180)
-        order_data = (Order.objects.filter(date_added__gt=starting_day).annotate(day=TruncDay("date_added")).values("day").annotate(c=Count("id")))
+        order_data = DailyOrderCount.objects.filter(day__gt=starting_day.date()).order_by("day")
 
-        labels = [x["day"].strftime("%Y-%m-%d") for x in order_data]
-        values = [x["c"] for x in order_data]
+        labels = [x.day.strftime("%Y-%m-%d") for x in order_data]
+        values = [x.count for x in order_data]
         context = dict(self.each_context(request), title="Orders per day", labels=labels, values=values,)
         
         return TemplateResponse(request, "orders_per_day.html", context)
 
+    @replica_reads()
     def most_bought_products(self, request):
+        labels = None
+        values = None
         if request.method == "POST":
             form = PeriodSelectForm(request.POST)
             if form.is_valid():
                 days = form.cleaned_data["period"]
                 starting_day = datetime.now() - timedelta(days=days)
 
-            data = (
-                 OrderLine.objects.filter(
-                     order__date_added__gt=starting_day
+                data = (
+                     DailyProductSales.objects.filter(
+                         day__gt=starting_day.date()
+                     )
+                     .values("product__name")
+                     .annotate(c=Sum("units"))
                  )
-                 .values("product__name")
-                 .annotate(c=Count("id"))
-             )
-            logger.info(
-                "most_bought_products query: %s", data.query
-            )
-            labels = [x["product__name"] for x in data]
-            values = [x["c"] for x in data]
+                logger.info(
+                    "most_bought_products query: %s", data.query
+                )
+                labels = [x["product__name"] for x in data]
+                values = [x["c"] for x in data]
         else:
             form = PeriodSelectForm()
-            labels = None
-            values = None
         context = dict(
             self.each_context(request),
             title="Most bought products",
@@ -389,31 +396,25 @@ class InvoiceMixin:
         order = get_object_or_404(Order, pk=order_id)
 
         if request.GET.get("format") == "pdf":
-            html_string = render_to_string(
-                "invoice.html", {"order": order}
-            )
-            html = HTML(
-                string=html_string,
-                base_url=request.build_absolute_uri(),
-            )
-
-            result = html.write_pdf()
-
-            response = HttpResponse(
-                content_type="application/pdf"
+            # The PDF is rendered once per version of the order and kept on
+            # storage. Clients that already have this version get a 304
+            last_modified = int(order.date_updated.timestamp())
+            etag = quote_etag(invoices.invoice_version(order))
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                return response
+
+            path = invoices.get_invoice(order, request.build_absolute_uri())
+            response = FileResponse(
+                invoices.invoice_storage.open(path, "rb"),
+                content_type="application/pdf",
             )
             response[
                 "Content-Disposition"
             ] = "inline; filename=invoice.pdf"
-            response["Content-Transfer-Encoding"] = "binary"
-            with tempfile.NamedTemporaryFile(
-                delete=True
-            ) as output:
-                output.write(result)
-                output.flush()
-                output = open(output.name, "rb")
-                binary_pdf = output.read()
-                response.write(binary_pdf)
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+            patch_cache_control(response, private=True, max_age=settings.INVOICE_CACHE_MAX_AGE)
 
             return response
 
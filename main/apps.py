@@ -5,4 +5,4 @@ class MainConfig(AppConfig):
     name = 'main'
 
     def ready(self):
-        from . import signals
+        from . import checks, signals
@@ -0,0 +1,171 @@
+"""Baskets of anonymous visitors kept in a signed cookie instead of the database,
+    so browsing and filling a basket without an account writes nothing. The
+    cookie only holds product ids, quantities and the cached total. It becomes
+    a database Basket at login, see merge_baskets_if_found, or at checkout"""
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, When
+
+from decimal import Decimal
+import logging
+
+from .models import Basket, BasketLine, Product, deferred_basket_totals
+
+logger = logging.getLogger(__name__)
+
+BASKET_COOKIE = "basket"
+BASKET_COOKIE_SALT = "main.baskets"
+# Bounds the cookie size together with ANONYMOUS_BASKET_MAX_LINES
+MAX_QUANTITY = 999
+
+class CookieBasket:
+    """Stands in for a Basket in the views and templates: is_empty(), count(),
+        summary() and refresh_totals() behave the same. Changes are written
+        back to the cookie by basket_middleware"""
+
+    def __init__(self, request, quantities=None, total=None):
+        self.quantities = dict(quantities or {}) # product id -> quantity, in insertion order
+        self.total = Decimal(total) if total is not None else Decimal("0.00")
+        self.modified = False
+        self._products = None
+        request.cookie_basket = self
+
+    @classmethod
+    def from_request(cls, request):
+        """The basket in the request cookie, None if there is none. A cookie that
+            was tampered with gives an empty basket, deleting the cookie"""
+        value = request.COOKIES.get(BASKET_COOKIE)
+        if not value:
+            return None
+        try:
+            payload = signing.loads(value, salt=BASKET_COOKIE_SALT, max_age=settings.SESSION_COOKIE_AGE)
+            quantities = {int(product_id): int(quantity) for product_id, quantity in payload["lines"]}
+            total = Decimal(payload["total"])
+        except (signing.BadSignature, KeyError, TypeError, ValueError, ArithmeticError):
+            logger.info("Discarding an invalid basket cookie")
+            basket = cls(request)
+            basket.modified = True
+            return basket
+        return cls(request, quantities, total)
+
+    def __bool__(self):
+        return bool(self.quantities)
+
+    def is_empty(self):
+        return not self.quantities
+
+    def count(self):
+        return sum(self.quantities.values())
+
+    def summary(self):
+        return {"count": self.count(), "total": str(self.total)}
+
+    def products(self):
+        """The products of the basket by id. Lines of products deleted since are dropped"""
+        if self._products is None:
+            self._products = Product.objects.in_bulk(list(self.quantities))
+            for product_id in set(self.quantities) - set(self._products):
+                self.remove(product_id)
+        return self._products
+
+    def lines(self):
+        """Unsaved BasketLine instances, for the templates and forms made for baskets"""
+        products = self.products()
+        return [
+            BasketLine(product=products[product_id], quantity=quantity)
+            for product_id, quantity in self.quantities.items()
+        ]
+
+    def add(self, product, quantity=1):
+        """Add quantity of product, False when the basket already holds
+            ANONYMOUS_BASKET_MAX_LINES other products"""
+        if product.id not in self.quantities and len(self.quantities) >= settings.ANONYMOUS_BASKET_MAX_LINES:
+            return False
+        current = self.quantities.get(product.id, 0)
+        added = min(current + quantity, MAX_QUANTITY) - current
+        self.quantities[product.id] = current + added
+        self.total += product.price * added
+        self.modified = True
+        return True
+
+    def set_quantity(self, product_id, quantity):
+        if product_id in self.quantities:
+            self.quantities[product_id] = min(quantity, MAX_QUANTITY)
+            self.modified = True
+
+    def set_quantities(self, quantities):
+        """Same as Basket.set_quantities()"""
+        found = set(quantities) & set(self.products())
+        for product_id in found:
+            if quantities[product_id]:
+                self.set_quantity(product_id, quantities[product_id])
+            else:
+                self.remove(product_id)
+        self.refresh_totals()
+        return found
+
+    def remove(self, product_id):
+        if self.quantities.pop(product_id, None) is not None:
+            self.modified = True
+
+    def clear(self):
+        self.quantities = {}
+        self.total = Decimal("0.00")
+        self.modified = True
+
+    def refresh_totals(self):
+        """Recompute the total from the current prices, after the quantities changed"""
+        products = self.products()
+        self.total = sum(
+            (products[product_id].price * quantity for product_id, quantity in self.quantities.items()),
+            Decimal("0.00"),
+        )
+        self.modified = True
+
+    def merge_into(self, basket):
+        """Add the lines to the database basket, then empty the cookie"""
+        with transaction.atomic(), deferred_basket_totals() as pending:
+            pending.add(basket.pk)
+            product_ids = set(self.products())
+            existing = set(
+                basket.basketline_set.filter(product_id__in=product_ids).values_list("product_id", flat=True)
+            )
+            if existing:
+                basket.basketline_set.filter(product_id__in=existing).update(
+                    quantity=F("quantity") + Case(
+                        *[When(product_id=product_id, then=self.quantities[product_id]) for product_id in existing],
+                        output_field=PositiveIntegerField(),
+                    )
+                )
+            BasketLine.objects.bulk_create(
+                BasketLine(basket=basket, product_id=product_id, quantity=quantity)
+                for product_id, quantity in self.quantities.items()
+                if product_id not in existing
+            )
+        logger.info(f"Moved {len(self.quantities)} lines of a cookie basket to basket id {basket.id}")
+        self.clear()
+
+    def to_basket(self, user):
+        """Store the basket in the database for user, merged into the open basket
+            of user if there is one"""
+        basket = Basket.objects.filter(user=user, status=Basket.OPEN).first()
+        if basket is None:
+            basket = Basket.objects.create(user=user)
+        self.merge_into(basket)
+        basket.refresh_totals()
+        return basket
+
+    def set_cookie(self, response):
+        if not self.quantities:
+            response.delete_cookie(BASKET_COOKIE)
+            return
+        value = signing.dumps(
+            {"lines": list(self.quantities.items()), "total": str(self.total)},
+            salt=BASKET_COOKIE_SALT,
+            compress=True,
+        )
+        response.set_cookie(
+            BASKET_COOKIE, value, max_age=settings.SESSION_COOKIE_AGE, httponly=True, samesite="Lax"
+        )
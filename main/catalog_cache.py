@@ -0,0 +1,76 @@
+"""Product listing pages are cached under keys that embed a version token per
+    tag slug ("all" being the unfiltered listing) and a global generation token.
+    Product detail pages work the same with a version token per product.
+    Invalidating only deletes the tokens, the stale pages are never read again
+    and expire on their own. Workers invalidate too, so the cache has to be
+    shared by every process, see CACHES and main.checks"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import QuerySet
+
+from .models import ProductTag
+
+import logging
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "catalog:generation"
+
+def _version_key(tag):
+    return f"catalog:version:{tag}"
+
+def _product_key(product_id):
+    return f"catalog:product:{product_id}"
+
+def _token(key):
+    return cache.get_or_set(key, lambda: uuid4().hex, None)
+
+def get_listing_page(tag, page_number, build):
+    """Return the cached listing page for tag, calling build() to make it on a miss"""
+    key = f"catalog:page:{_token(GENERATION_KEY)}:{tag}:{_token(_version_key(tag))}:{page_number}"
+    page = cache.get(key)
+    if page is None:
+        page = build()
+        cache.set(key, page, settings.CATALOG_CACHE_TIMEOUT)
+    return page
+
+def get_product_page(product_id, build):
+    """Return the cached detail page of a product, calling build() to make it on a miss"""
+    key = f"catalog:detail:{_token(GENERATION_KEY)}:{product_id}:{_token(_product_key(product_id))}"
+    page = cache.get(key)
+    if page is None:
+        page = build()
+        cache.set(key, page, settings.CATALOG_CACHE_TIMEOUT)
+    return page
+
+def invalidate_tags(tags):
+    """Drop the cached listing pages of the given tag slugs"""
+    tags = set(tags)
+    if tags:
+        logger.debug(f"Invalidating cached listings for tags {sorted(tags)}")
+        cache.delete_many([_version_key(tag) for tag in tags])
+
+def invalidate_product_pages(product_ids):
+    """Drop the cached detail pages of the given product ids"""
+    product_ids = set(product_ids)
+    if product_ids:
+        cache.delete_many([_product_key(product_id) for product_id in product_ids])
+
+def invalidate_products(products):
+    """Drop the cached detail pages of the given products and the listing pages
+        that can show any of them. products can be a queryset or a list of
+        Product instances or ids"""
+    if isinstance(products, QuerySet):
+        product_ids = list(products.values_list("pk", flat=True))
+    else:
+        product_ids = [getattr(product, "pk", product) for product in products]
+    invalidate_product_pages(product_ids)
+    invalidate_tags(
+        ["all"] + list(ProductTag.objects.filter(product__in=product_ids).values_list("slug", flat=True))
+    )
+
+def invalidate_all():
+    logger.info("Invalidating all cached listings")
+    cache.delete(GENERATION_KEY)
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.checks import Warning, register, Tags
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """The cached catalog pages are invalidated through the cache, which a
+        LocMemCache keeps within the process making the change"""
+    backend = settings.CACHES["default"]["BACKEND"]
+    if backend == "django.core.cache.backends.locmem.LocMemCache":
+        return [
+            Warning(
+                "The default cache is local to each process, other server processes and "
+                "the workers don't see the invalidations of the catalog cache",
+                hint="Set CACHE_REDIS_URL or REDIS_URL, LocMemCache is for development only.",
+                id="main.W001",
+            )
+        ]
+    return []
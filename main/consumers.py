@@ -0,0 +1,36 @@
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .dispatch import DISPATCH_GROUP
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+class DispatchConsumer(AsyncJsonWebsocketConsumer):
+    """Pushes order and order line status changes to dispatchers. The user comes
+        from the session through AuthMiddlewareStack, anybody who is not a
+        dispatcher is refused"""
+
+    async def connect(self):
+        user = self.scope.get("user")
+        if user is None or not await database_sync_to_async(self.is_dispatcher)(user):
+            await self.close()
+            return
+
+        await self.channel_layer.group_add(DISPATCH_GROUP, self.channel_name)
+        await self.accept()
+        logger.info(f"Dispatcher {user.email} connected to the dispatch feed")
+
+    def is_dispatcher(self, user):
+        return user.is_authenticated and user.is_dispatcher
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(DISPATCH_GROUP, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        # The feed is one way, clients change orders through the API
+        pass
+
+    async def dispatch_events(self, message):
+        await self.send_json({"events": message["events"]})
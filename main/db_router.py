@@ -0,0 +1,132 @@
+"""Read-heavy workloads (reports, the order dashboard, the dispatch API reads)
+    opt in to reading from the replica configured as settings.REPLICA_DATABASE,
+    everything else stays on the primary. A client that wrote recently is kept
+    on the primary by replica_pin_middleware, so it reads its own writes despite
+    the replication lag. Other clients may read rows that are behind by the lag.
+    A replica that can't be reached, or that fails a query of a replica_view, is
+    skipped for REPLICA_RETRY_SECONDS and the view is served from the primary"""
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, OperationalError, connections
+from django.template.response import SimpleTemplateResponse
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Always read from the primary, without pinning the client when written. A
+# session created by a login has to be found by the very next request
+PRIMARY_ONLY_APPS = {"sessions"}
+
+_replica_reads = ContextVar("replica_reads", default=None)
+_request_state = ContextVar("replica_request_state", default=None)
+_replica_down_until = 0
+
+class RequestState:
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+@contextmanager
+def request_state(pinned):
+    """Track the writes of a request, pinned tells the client wrote recently"""
+    state = RequestState(pinned)
+    token = _request_state.set(state)
+    try:
+        yield state
+    finally:
+        _request_state.reset(token)
+
+class ReplicaReads:
+    def __init__(self):
+        self.used = False
+
+@contextmanager
+def replica_reads():
+    """Send the reads made inside the block to the replica. Also works as a
+        decorator. The yielded ReplicaReads tells if a read went to the replica"""
+    reads = ReplicaReads()
+    token = _replica_reads.set(reads)
+    try:
+        yield reads
+    finally:
+        _replica_reads.reset(token)
+
+def replica_view(view_func):
+    """Serve the safe requests of a view from the replica. Template responses are
+        rendered inside, as their querysets are only evaluated then"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return view_func(request, *args, **kwargs)
+        # Resolve the lazy user against the primary, a new user may not be on the replica yet
+        if hasattr(request, "user"):
+            request.user.is_authenticated
+        try:
+            with replica_reads() as reads:
+                return render(view_func(request, *args, **kwargs))
+        except OperationalError:
+            # The replica accepted the connection but failed a query, the safe
+            # request is served again from the primary
+            if not reads.used:
+                raise
+            replica_down(settings.REPLICA_DATABASE)
+        return render(view_func(request, *args, **kwargs))
+    return wrapper
+
+def render(response):
+    if isinstance(response, SimpleTemplateResponse):
+        response.render()
+    return response
+
+def replica_down(alias):
+    """Read from the primary for the next REPLICA_RETRY_SECONDS"""
+    global _replica_down_until
+    logger.warning(f"Replica database {alias} is unavailable, reading from the primary")
+    _replica_down_until = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+
+def replica_available(alias):
+    if time.monotonic() < _replica_down_until:
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        replica_down(alias)
+        return False
+    return True
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = settings.REPLICA_DATABASE
+        reads = _replica_reads.get()
+        if reads is None or alias not in connections.databases:
+            return None
+        if model._meta.app_label in PRIMARY_ONLY_APPS:
+            return DEFAULT_DB_ALIAS
+
+        state = _request_state.get()
+        if state is not None and (state.pinned or state.wrote):
+            return DEFAULT_DB_ALIAS
+        if not replica_available(alias):
+            return DEFAULT_DB_ALIAS
+        reads.used = True
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None and model._meta.app_label not in PRIMARY_ONLY_APPS:
+            state.wrote = True
+        # Explicit, or instances read from the replica would be saved back to it
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, settings.REPLICA_DATABASE}:
+            return True
+        return None
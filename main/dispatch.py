@@ -0,0 +1,38 @@
+"""Real-time feed of order activity for the dispatchers. Events are published to
+    a channel layer group that every connected DispatchConsumer belongs to"""
+
+from django.db import transaction
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_GROUP = "dispatch"
+
+def orderline_event(line_id, order_id, product_id, status):
+    return {"type": "orderline", "id": line_id, "order": order_id, "product": product_id, "status": status}
+
+def order_event(order_id, status):
+    return {"type": "order", "id": order_id, "status": status}
+
+def publish(events):
+    """Send events to the dispatchers once the current transaction commits, so
+        they never see changes that get rolled back"""
+    events = list(events)
+    if events:
+        transaction.on_commit(lambda: _send(events))
+
+def _send(events):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            DISPATCH_GROUP, {"type": "dispatch.events", "events": events}
+        )
+    except Exception:
+        # The feed is best effort, clients resync through the API when they reconnect
+        logger.exception("Publishing dispatch events failed")
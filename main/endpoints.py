@@ -1,6 +1,66 @@
+from django.conf import settings
+from django.db.models import F
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date, quote_etag
 from rest_framework import serializers, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import BasePermission
+from rest_framework.response import Response
+
+from .db_router import replica_view
+from .models import ChangeLog, Order, OrderLine
+
+import hashlib
+import time
+
+class DispatchCursorPagination(CursorPagination):
+    """Keyset pagination on the primary key, which follows the creation order
+        and is indexed, so deep pages cost the same as the first one and no
+        COUNT is needed"""
+    ordering = "-id"
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+
+class ConditionalListMixin:
+    """Answers list requests with ETag and Last-Modified validators computed from
+        a narrow query over the rows of the requested page. The full page is
+        only fetched and serialized when the client copy is stale.
+        version_fields are the columns that change whenever a serialized row
+        does, the first one being the pagination ordering field and the others
+        modification dates. Only the ETag is used to answer 304, rows leaving
+        the page don't move Last-Modified"""
+    pagination_class = DispatchCursorPagination
+    version_fields = ("id",)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = self.paginate_queryset(queryset.values(*self.version_fields))
+
+        etag, last_modified = self.page_validators(rows)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            ids = [row["id"] for row in rows]
+            objects = {obj.pk: obj for obj in queryset.filter(pk__in=ids)}
+            serializer = self.get_serializer([objects[pk] for pk in ids if pk in objects], many=True)
+            response = self.get_paginated_response(serializer.data)
+
+        response["ETag"] = etag
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+        return response
+
+    def page_validators(self, rows):
+        digest = hashlib.md5(self.request.accepted_media_type.encode())
+        dates = []
+        for row in rows:
+            digest.update(repr([row[field] for field in self.version_fields]).encode())
+            dates.extend(row[field] for field in self.version_fields[1:] if row[field])
+        return quote_etag(digest.hexdigest()), max(dates, default=None)
 
-from .models import Order, OrderLine
 
 class OrderLineSerializer(serializers.HyperlinkedModelSerializer):
     product = serializers.StringRelatedField()
@@ -11,10 +71,40 @@ class OrderLineSerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = ('id', 'order', 'product')
 
 
-class PaidOrderLineViewSet(viewsets.ModelViewSet):
-    queryset = OrderLine.objects.filter(order__status=Order.PAID).order_by("-order__date_added")
+class OrderLineStatusSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=OrderLine.STATUSES)
+
+
+class BulkOrderLineStatusSerializer(serializers.Serializer):
+    lines = serializers.ListField(child=OrderLineStatusSerializer(), min_length=1, max_length=1000)
+
+
+@method_decorator(replica_view, name="dispatch")
+class PaidOrderLineViewSet(ConditionalListMixin, viewsets.ModelViewSet):
+    # The hyperlink to the order only needs order_id, the product is joined for its name
+    queryset = OrderLine.objects.filter(order__status=Order.PAID).select_related("product")
     serializer_class = OrderLineSerializer
     filter_fields = ('order','status')
+    version_fields = ("id", "date_updated", "product__date_updated")
+
+    @action(detail=False, methods=["patch"], serializer_class=BulkOrderLineStatusSerializer)
+    def bulk(self, request):
+        """Set the status of many lines at once, {"lines": [{"id": 1, "status": 30}, ...]}.
+            All the lines are updated in one transaction and every order is
+            rolled up once. A line given twice gets its last status. Lines
+            that are not part of a paid order are reported and skipped"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        statuses = {line["id"]: line["status"] for line in serializer.validated_data["lines"]}
+
+        updated = set(OrderLine.objects.filter(order__status=Order.PAID).set_statuses(statuses))
+        results = [
+            {"id": line_id, "status": status, "updated": True} if line_id in updated
+            else {"id": line_id, "updated": False, "error": "Not found."}
+            for line_id, status in statuses.items()
+        ]
+        return Response({"results": results})
 
 
 class OrderSerializer(serializers.HyperlinkedModelSerializer):
@@ -29,9 +119,117 @@ class OrderSerializer(serializers.HyperlinkedModelSerializer):
                   'date_updated',
                   'date_added')
 
-class PaidOrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.filter(status=Order.PAID).order_by("-date_added")
+@method_decorator(replica_view, name="dispatch")
+class PaidOrderViewSet(ConditionalListMixin, viewsets.ModelViewSet):
+    queryset = Order.objects.filter(status=Order.PAID)
     serializer_class = OrderSerializer
+    version_fields = ("id", "date_updated")
+
+
+
+class OrderChangeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Order
+        fields = ('id',
+                  'status',
+                  'shipping_name',
+                  'shipping_address1',
+                  'shipping_address2',
+                  'shipping_zipcode',
+                  'shipping_city',
+                  'shipping_country',
+                  'date_updated',
+                  'date_added')
+
+class OrderLineChangeSerializer(serializers.ModelSerializer):
+    product = serializers.StringRelatedField()
+
+    class Meta:
+        model = OrderLine
+        fields = ('id', 'order', 'product', 'status', 'date_updated')
+
+
+class IsDispatcher(BasePermission):
+    """Same check as DispatchConsumer, the model permissions would let any
+        logged in customer read"""
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.is_dispatcher
+
+
+@method_decorator(replica_view, name="dispatch")
+class ChangeFeedViewSet(viewsets.GenericViewSet):
+    """Delta-sync feed of the orders dispatch handles, paid or done, and of
+        their lines. GET /api/changes/?since=<cursor> returns the records
+        changed after the cursor, once each with their current data or as
+        deleted, and the cursor to pass next time. "more" tells there are
+        changes left past limit. With wait=<seconds> the request is held until
+        something changes, up to settings.CHANGE_FEED_MAX_WAIT"""
+    queryset = ChangeLog.objects.all()
+    permission_classes = (IsDispatcher,)
+    dispatch_statuses = (Order.PAID, Order.DONE)
+    # The serializer and the status of the order of each resource
+    resources = {
+        ChangeLog.ORDER: (Order.objects.all(), OrderChangeSerializer, lambda order: order.status),
+        ChangeLog.ORDERLINE: (
+            OrderLine.objects.select_related("product").annotate(order_status=F("order__status")),
+            OrderLineChangeSerializer,
+            lambda line: line.order_status,
+        ),
+    }
+
+    def int_param(self, name, default, minimum=0):
+        try:
+            value = int(self.request.query_params.get(name, default))
+        except ValueError:
+            value = minimum - 1
+        if value < minimum:
+            raise ValidationError({name: f"Expected an integer of at least {minimum}."})
+        return value
+
+    def list(self, request):
+        since = self.int_param("since", 0)
+        limit = min(self.int_param("limit", 500, minimum=1), 1000)
+        deadline = time.monotonic() + min(self.int_param("wait", 0), settings.CHANGE_FEED_MAX_WAIT)
+
+        while True:
+            # Positions follow the commit order, see ChangeLogManager.sequence
+            entries = list(self.get_queryset().filter(position__gt=since).order_by("position")[:limit + 1])
+            if entries or time.monotonic() >= deadline:
+                break
+            time.sleep(settings.CHANGE_FEED_POLL_INTERVAL)
+
+        more = len(entries) > limit
+        entries = entries[:limit]
+
+        # Only the last change of each record matters, in the order of those changes
+        latest = {}
+        for entry in entries:
+            key = (entry.resource, entry.object_id)
+            latest.pop(key, None)
+            latest[key] = entry
+
+        changes = []
+        for resource, (queryset, serializer_class, order_status) in self.resources.items():
+            objects = queryset.in_bulk([object_id for (r, object_id) in latest if r == resource])
+            for (r, object_id), entry in latest.items():
+                if r != resource:
+                    continue
+                obj = objects.get(object_id)
+                if obj is not None and order_status(obj) not in self.dispatch_statuses:
+                    # Logged again once the order is paid, see order_to_change_log
+                    continue
+                changes.append((entry.position, {
+                    "resource": resource,
+                    "id": object_id,
+                    "deleted": obj is None,
+                    "data": serializer_class(obj).data if obj is not None else None,
+                }))
+
+        return Response({
+            "changes": [change for _, change in sorted(changes, key=lambda c: c[0])],
+            "cursor": entries[-1].position if entries else since,
+            "more": more,
+        })
 
 
 
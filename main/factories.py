@@ -13,6 +13,7 @@ class UserFactory(factory.django.DjangoModelFactory):
 
 class ProductFactory(factory.django.DjangoModelFactory):
     price = factory.fuzzy.FuzzyDecimal(1.0, 1000.0, 2)
+    slug = factory.Sequence(lambda n: f"product-{n}")
 
     class Meta:
         model = Product
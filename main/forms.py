@@ -1,11 +1,12 @@
 from django import forms
-from django.core.mail import send_mail
 from django.contrib.auth.forms import UserCreationForm as DjangoUserCreationForm
 from django.contrib.auth.forms import UsernameField
 from django.contrib.auth import authenticate
-from django.forms import inlineformset_factory
+from django.forms import BaseInlineFormSet, formset_factory, inlineformset_factory
 
+from .baskets import MAX_QUANTITY
 from .models import User, Basket, BasketLine, Address
+from .outbox import send_mail
 from .widgets import PlusMinusNumberInput
 
 import logging
@@ -27,8 +28,7 @@ class UserCreationForm(DjangoUserCreationForm):
         send_mail("Welcome to Booktime",
                     message,
                     "admin@booktime.com",
-                    [self.cleaned_data['email']],
-                    fail_silently=True)
+                    [self.cleaned_data['email']])
 
 class AuthenticationForm(forms.Form):
     email = forms.EmailField()
@@ -69,22 +69,84 @@ class ContactForm(forms.Form):
         send_mail("Site message", # Subject
                     message, # Message
                     "site@booktime.com", # From
-                    ["natrajm93@gmail.com"], # To
-                    fail_silently=False)
+                    ["natrajm93@gmail.com"]) # To
 
 
 """Formsets can quickly bulk create related forms. we use inline because the models are related.
     This will create a form for all Basketline objects connected to the basket with the only
     editable field being the quantity. Formsets can also do CRUD operations"""
+class BaseBasketLineFormset(BaseInlineFormSet):
+    def get_queryset(self):
+        # The template shows the name of the product of every line
+        return super().get_queryset().select_related("product")
+
+
 BasketLineFormset = inlineformset_factory(
     Basket,
     BasketLine,
+    formset = BaseBasketLineFormset,
     fields = ("quantity",),
     extra = 0,
     widgets = {"quantity": PlusMinusNumberInput()},
 )
 
 
+class CookieBasketLineForm(forms.ModelForm):
+    """The quantity form of BasketLineFormset for a line of a cookie basket. The
+        product id stands in for the primary key of the line"""
+    quantity = forms.IntegerField(min_value=1, max_value=MAX_QUANTITY, widget=PlusMinusNumberInput())
+    product_id = forms.IntegerField(widget=forms.HiddenInput)
+
+    class Meta:
+        model = BasketLine
+        fields = ("quantity",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.product_id:
+            self.initial["product_id"] = self.instance.product_id
+
+
+class BaseCookieBasketLineFormset(forms.BaseFormSet):
+    """Takes instance=<CookieBasket> like BasketLineFormset takes the basket, so
+        manage_basket and the template work the same with both"""
+    def __init__(self, data=None, *args, instance, **kwargs):
+        self.instance = instance
+        self.lines = instance.lines()
+        kwargs.setdefault("initial", [{} for _ in self.lines])
+        super().__init__(data, *args, **kwargs)
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        if index is not None and index < len(self.lines):
+            kwargs["instance"] = self.lines[index]
+        return kwargs
+
+    def save(self):
+        for form in self.forms:
+            product_id = form.cleaned_data.get("product_id")
+            if product_id is None:
+                continue
+            if self.can_delete and self._should_delete_form(form):
+                self.instance.remove(product_id)
+            else:
+                self.instance.set_quantity(product_id, form.cleaned_data["quantity"])
+
+
+class BasketLineChangeForm(forms.Form):
+    """A line change posted to the basket API, a quantity of 0 removes the line"""
+    product_id = forms.IntegerField()
+    quantity = forms.IntegerField(min_value=0, max_value=MAX_QUANTITY)
+
+
+CookieBasketLineFormset = formset_factory(
+    CookieBasketLineForm,
+    formset = BaseCookieBasketLineFormset,
+    extra = 0,
+    can_delete = True,
+)
+
+
 class AddressSelectionForm(forms.Form):
     billing_address = forms.ModelChoiceField(queryset = None)
     shipping_address = forms.ModelChoiceField(queryset = None)
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.template.loader import render_to_string
+
+import logging
+import os
+
+from weasyprint import HTML
+
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+class InvoiceStorage(FileSystemStorage):
+    """Invoices hold the names and addresses of customers, so they are stored at
+        INVOICE_ROOT instead of MEDIA_ROOT, which is served to anyone. They
+        are only served by the admin invoice view, behind its permission check"""
+
+    @property
+    def base_location(self):
+        return settings.INVOICE_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+    def url(self, name):
+        raise ValueError("Invoices have no public URL")
+
+invoice_storage = InvoiceStorage()
+
+def invoice_version(order):
+    """Identifies the invoice content, any change to the order gives a new version"""
+    return f"{order.id}-{int(order.date_updated.timestamp() * 1000000)}"
+
+def invoice_path(order):
+    """Each order has its own directory, so only its own versions are listed
+        when a new one replaces them"""
+    return f"{order.id}/{int(order.date_updated.timestamp() * 1000000)}.pdf"
+
+def render_invoice(order, base_url=None):
+    """Render the invoice of order to PDF bytes with WeasyPrint"""
+    html_string = render_to_string("invoice.html", {"order": order})
+    return HTML(string=html_string, base_url=base_url).write_pdf()
+
+def get_invoice(order, base_url=None):
+    """Return the storage path of the PDF invoice of order, rendering and storing
+        it if this version of the order has no invoice yet. Invoices of previous
+        versions of the order are removed"""
+    path = invoice_path(order)
+    if invoice_storage.exists(path):
+        return path
+
+    logger.info(f"Rendering invoice for order {order.id}")
+    pdf = render_invoice(order, base_url)
+
+    directory = str(order.id)
+    if invoice_storage.exists(directory):
+        for name in invoice_storage.listdir(directory)[1]:
+            invoice_storage.delete(f"{directory}/{name}")
+
+    return invoice_storage.save(path, ContentFile(pdf))
+
+def prerender_invoice(order_id):
+    """Render the invoice ahead of the first request, see INVOICE_PRERENDER_ON_PAID"""
+    order = Order.objects.filter(pk=order_id).first()
+    if order is not None:
+        get_invoice(order, settings.INVOICE_BASE_URL)
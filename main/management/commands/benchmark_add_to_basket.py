@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from main.models import Basket, BasketLine, Product
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+class Command(BaseCommand):
+    help = 'Add one product to one basket from many threads at once and check no increment is lost'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type = int, default = 8,
+                            help = "Concurrent clients, each with its own database connection")
+        parser.add_argument("--adds", type = int, default = 50,
+                            help = "Adds per client")
+
+    def handle(self, *args, **options):
+        product = Product.objects.active().first()
+        if product is None:
+            raise CommandError("No active products, load some with import_data first")
+
+        threads, adds = options["threads"], options["adds"]
+        basket = Basket.objects.create()
+        # All the clients start together, so the first adds race to create the line
+        barrier = threading.Barrier(threads)
+
+        def client(_):
+            try:
+                barrier.wait()
+                for _ in range(adds):
+                    Basket(pk=basket.pk).add_product(product)
+            finally:
+                connection.close()
+
+        try:
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(client, range(threads)))
+            elapsed = time.monotonic() - started
+
+            lines = list(BasketLine.objects.filter(basket=basket).values_list("quantity", flat=True))
+            basket.refresh_totals()
+            expected = threads * adds
+            self.stdout.write(
+                f"{expected} adds in {elapsed:.2f}s ({expected / elapsed:.0f}/s): "
+                f"{len(lines)} line(s), quantity {sum(lines)}, basket count {basket.count()}"
+            )
+            if lines != [expected] or basket.count() != expected:
+                raise CommandError(f"Lost {expected - sum(lines)} updates")
+            self.stdout.write("No update lost")
+        finally:
+            basket.delete()
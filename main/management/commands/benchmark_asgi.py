@@ -0,0 +1,99 @@
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db.backends.signals import connection_created
+from django.urls import reverse
+from main.models import Product
+
+from asgiref.sync import async_to_sync
+from booktime.handlers import ThreadPoolASGIHandler
+
+import asyncio
+import statistics
+import time
+
+class Command(BaseCommand):
+    help = 'Compare the throughput of the stock ASGI handler and ThreadPoolASGIHandler on the customer pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type = int, default = 1000,
+                            help = "Requests per handler")
+        parser.add_argument("--concurrency", type = int, default = 32,
+                            help = "Requests in flight at once")
+        parser.add_argument("--db-latency", type = float, default = 0,
+                            help = "Milliseconds added to every query, like a database over the network")
+
+    def handle(self, *args, **options):
+        products = list(Product.objects.active().values_list("id", "slug")[:20])
+        if not products:
+            raise CommandError("No active products, load some with import_data first")
+
+        paths = [reverse("app-home"), reverse("products", kwargs={"tag": "all"}), reverse("basket")]
+        for product_id, slug in products:
+            paths.append(reverse("product", args=(slug,)))
+            paths.append(f"{reverse('add_to_basket')}?product_id={product_id}")
+
+        latency = options["db_latency"] / 1000
+        def slow_query(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            connection.execute_wrappers.append(slow_query)
+
+        if latency:
+            connection_created.connect(add_latency)
+        try:
+            for name, handler in (("ASGIHandler", ASGIHandler()), ("ThreadPoolASGIHandler", ThreadPoolASGIHandler())):
+                results, elapsed = async_to_sync(self.run)(
+                    handler, paths, options["requests"], options["concurrency"]
+                )
+                timings = sorted(timing for timing, status in results)
+                errors = sum(1 for timing, status in results if status >= 400)
+                self.stdout.write(
+                    f"{name:<22} {len(results) / elapsed:8.1f} req/s  "
+                    f"p50 {statistics.median(timings):7.1f}ms  "
+                    f"p95 {timings[int(len(timings) * 0.95)]:7.1f}ms  "
+                    f"({errors} errors)"
+                )
+        finally:
+            connection_created.disconnect(add_latency)
+
+    async def run(self, handler, paths, total, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            async with semaphore:
+                started = time.perf_counter()
+                status = await self.request(handler, paths[i % len(paths)])
+                return (time.perf_counter() - started) * 1000, status
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(total)))
+        return results, time.perf_counter() - started
+
+    async def request(self, handler, url):
+        path, _, query_string = url.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "query_string": query_string.encode(),
+            "headers": [(b"host", b"localhost")],
+            # Outside INTERNAL_IPS, the debug toolbar would be rendered otherwise
+            "client": ("192.0.2.1", 50000),
+            "server": ("localhost", 80),
+        }
+        response = {}
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+
+        await handler(scope, receive, send)
+        return response["status"]
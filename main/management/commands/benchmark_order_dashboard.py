@@ -0,0 +1,107 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from main.models import Order, User
+from main.views import OrderFilter
+
+from datetime import timedelta
+from itertools import islice
+import random
+import statistics
+import time
+
+class Command(BaseCommand):
+    help = 'Time the order dashboard filters on a generated dataset, rolled back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type = int, default = 1000000,
+                            help = "Orders to generate")
+        parser.add_argument("--users", type = int, default = 50000,
+                            help = "Customers the orders are spread over")
+        parser.add_argument("--repeat", type = int, default = 5,
+                            help = "Runs per filter, the median is reported")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.generate(options["orders"], options["users"])
+            self.run_filters(options["repeat"])
+            # Nothing generated is kept
+            transaction.set_rollback(True)
+
+    def generate(self, order_count, user_count):
+        self.stdout.write(f"Generating {user_count} users and {order_count} orders...")
+        started = time.monotonic()
+        User.objects.bulk_create(
+            User(email=f"customer{i}@example.com", email_lookup=f"customer{i}@example.com") for i in range(user_count)
+        )
+        user_ids = list(User.objects.filter(email_lookup__startswith="customer").values_list("id", flat=True))
+
+        # Raw inserts, bulk_create would overwrite the auto_now dates
+        fields = ["user_id", "status", "date_added", "date_updated"] + [
+            f.column for f in Order._meta.concrete_fields
+            if f.column.startswith(("billing_", "shipping_"))
+        ]
+        sql = (
+            f"INSERT INTO {Order._meta.db_table} ({', '.join(fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(fields))})"
+        )
+        now = timezone.now()
+        statuses = [Order.NEW, Order.PAID, Order.DONE]
+
+        def rows():
+            for _ in range(order_count):
+                added = now - timedelta(minutes=random.randrange(60 * 24 * 365 * 3))
+                yield [random.choice(user_ids), random.choice(statuses), added, added + timedelta(hours=1)] + [""] * (len(fields) - 4)
+
+        rows = rows()
+        with connection.cursor() as cursor:
+            while True:
+                batch = list(islice(rows, 10000))
+                if not batch:
+                    break
+                cursor.executemany(sql, batch)
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {Order._meta.db_table}")
+        self.stdout.write(f"Generated in {time.monotonic() - started:.1f}s")
+
+    def run_filters(self, repeat):
+        today = timezone.localdate()
+        filters = {
+            "email exact": {"customer_email": "customer4242@example.com"},
+            "email prefix": {"customer_email": "customer424"},
+            "status": {"status": Order.PAID},
+            "status + added range": {
+                "status": Order.PAID,
+                "date_added__gt": today - timedelta(days=7),
+                "date_added__lt": today,
+            },
+            "updated range": {
+                "date_updated__gt": today - timedelta(days=2),
+                "date_updated__lt": today,
+            },
+        }
+        querysets = {
+            # The filter the dashboard had before, for comparison
+            "email icontains (old)": lambda: Order.objects.filter(user__email__icontains="customer424"),
+        }
+        for name, data in filters.items():
+            querysets[name] = lambda data=data: OrderFilter(data, queryset=Order.objects.all()).qs
+
+        for name, make_queryset in querysets.items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                # What the dashboard does: count for the paginator, then the first page
+                qs = make_queryset()
+                count = qs.count()
+                list(qs.order_by("-date_added")[:25])
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                f"{name:<22} {statistics.median(timings):8.1f}ms  ({count} orders)  {self.plan(qs)}"
+            )
+
+    def plan(self, qs):
+        """The indexes used by the first page query"""
+        plan = qs.order_by("-date_added")[:25].explain()
+        return " | ".join(line.strip() for line in plan.splitlines() if "INDEX" in line.upper())
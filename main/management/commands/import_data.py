@@ -1,11 +1,18 @@
 from django.core.management.base import BaseCommand
 from django.template.defaultfilters import slugify
 from django.core.files.images import ImageFile
-from main.models import Product, ProductTag, ProductImage
+from django.conf import settings
+from django.db import transaction
+from main.models import ImportCheckpoint, Product, ProductTag, ProductImage, ProductImageRendition
+from main import catalog_cache, search, thumbnails
 
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from itertools import islice
 import csv
 import os
+import time
 
 class Command(BaseCommand): # Command is a reserved name (it has to be named 'Command')
     help = 'Import Products into the database'
@@ -15,45 +22,181 @@ class Command(BaseCommand): # Command is a reserved name (it has to be named 'Co
         The extra arguments we add to the cmdline command are the path to the import csv and the images base directory"""
         parser.add_argument("csvfile", type = open)
         parser.add_argument("image_basedir", type = str)
+        parser.add_argument("--bulk", action = "store_true",
+                            help = "Stream the CSV in chunks using bulk queries, one transaction per chunk")
+        parser.add_argument("--chunk-size", type = int, default = 500,
+                            help = "Rows per chunk in bulk mode")
+        parser.add_argument("--processes", type = int, default = os.cpu_count(),
+                            help = "Processes used to resize images in bulk mode")
+        parser.add_argument("--resume", action = "store_true",
+                            help = "Skip the rows committed by a previous bulk run of the same file")
 
     def handle(self, *args, **options): # overlaod the handle method in BaseCommand
         self.stdout.write("Importing Products...")
 
+        if options["bulk"]:
+            return self.handle_bulk(**options)
+
         counter = Counter()
 
         reader = csv.DictReader(options.pop("csvfile"))
 
         for row in reader:
-            product, created = Product.objects.get_or_create(name=row['name'], price=row['price']) 
+            # Not get_or_create, its defaults would look for a free slug for
+            # the products that exist already
+            product = Product.objects.filter(name=row['name'], price=row['price']).first()
+            created = product is None
+            if created:
+                product = Product.objects.create(
+                    name=row['name'], price=row['price'], slug=Product.objects.unique_slug(row["name"])
+                )
             product.description = row["description"]
-            product.slug = slugify(row["name"])
 
             for book_tag in row["tags"].split("|"):
-                tag, tag_created =  ProductTag.objects.get_or_create(name=book_tag)
+                tag, tag_created =  ProductTag.objects.get_or_create(name=book_tag, defaults={"slug": slugify(book_tag)})
 
                 product.tags.add(tag)
 
                 counter["tags"] += 1
 
                 if tag_created:
-                    counter["tags_created"] += 1 
-            
+                    counter["tags_created"] += 1
+
             with open(os.path.join(options['image_basedir'],row['image_filename']), "rb") as f:
                 image = ProductImage(product = product,image = ImageFile(f,name=row['image_filename']))
                 image.save()
 
                 counter["images"] += 1
-            
+
             product.save()
             counter["products"] += 1
 
             if created:
                 counter["products_created"] += 1
-            
-            self.stdout.write(f"Products processed = {counter['products']} (created={counter['products_created']})")
-            self.stdout.write(f"Tags processed = {counter['tags']} (created={counter['tags_created']})")
-            self.stdout.write(f"Images processed = {counter['images']}")
-
 
+            self.write_counters(counter)
+
+    def write_counters(self, counter):
+        self.stdout.write(f"Products processed = {counter['products']} (created={counter['products_created']})")
+        self.stdout.write(f"Tags processed = {counter['tags']} (created={counter['tags_created']})")
+        self.stdout.write(f"Images processed = {counter['images']}")
+
+    def handle_bulk(self, csvfile, image_basedir, chunk_size, processes, resume, **options):
+        """Import the CSV chunk_size rows at a time. Every chunk is committed in its
+            own transaction together with the number of rows committed so far,
+            which --resume uses to continue after a failure"""
+        source = os.path.abspath(csvfile.name)
+        start_row = 0
+        if resume:
+            checkpoint = ImportCheckpoint.objects.filter(source=source).first()
+            if checkpoint is not None:
+                start_row = checkpoint.rows
+                self.stdout.write(f"Resuming after row {start_row}")
 
+        counter = Counter()
+        tags = {tag.name: tag for tag in ProductTag.objects.all()}
+        reader = islice(csv.DictReader(csvfile), start_row, None)
+        row_number = start_row
+        started = time.monotonic()
+
+        with ProcessPoolExecutor(max_workers=max(processes, 1)) as pool:
+            while True:
+                rows = list(islice(reader, chunk_size))
+                if not rows:
+                    break
+
+                paths = [os.path.join(image_basedir, row["image_filename"]) for row in rows]
+                rendered = pool.map(thumbnails.render_file, paths, [settings.THUMBNAIL_RENDITIONS] * len(rows))
+
+                row_number += len(rows)
+                with transaction.atomic():
+                    products = self.import_products(rows, counter)
+                    self.import_tags(rows, products, tags, counter)
+                    self.import_images(rows, paths, rendered, products, counter)
+                    search.get_backend().index([product.id for product in products.values()])
+                    ImportCheckpoint.objects.update_or_create(source=source, defaults={"rows": row_number})
+                catalog_cache.invalidate_products(products.values())
+
+                elapsed = time.monotonic() - started
+                self.write_counters(counter)
+                self.stdout.write(f"Rows committed = {row_number} ({(row_number - start_row) / elapsed:.1f} rows/s)")
+
+        ImportCheckpoint.objects.filter(source=source).delete()
+
+    def import_products(self, rows, counter):
+        """Create or update the products of a chunk with bulk queries. Products are
+            identified by name and price, as in the row by row import. Returns
+            the products keyed the same way"""
+        def key(name, price):
+            return (name, Decimal(price))
+
+        names = {row["name"] for row in rows}
+        products = {key(p.name, p.price): p for p in Product.objects.filter(name__in=names)}
+
+        # The slugs of the chunk are checked in one query. A taken one, as two prices
+        # of a title are two products, is numbered with a query of its own
+        taken = set(Product.objects.filter(slug__in={slugify(name) for name in names}).values_list("slug", flat=True))
+        new_products = {}
+        for row in rows:
+            row_key = key(row["name"], row["price"])
+            product = products.get(row_key) or new_products.get(row_key)
+            if product is None:
+                slug = slugify(row["name"])
+                if not slug or slug in taken:
+                    slug = Product.objects.unique_slug(row["name"], taken)
+                taken.add(slug)
+                product = new_products[row_key] = Product(name=row["name"], price=row_key[1], slug=slug)
+            product.description = row["description"]
 
+        Product.objects.bulk_update(list(products.values()), ["description"])
+        Product.objects.bulk_create(new_products.values())
+
+        counter["products"] += len(rows)
+        counter["products_created"] += len(new_products)
+
+        # bulk_create doesn't set primary keys on every backend, so read them back
+        return {key(p.name, p.price): p for p in Product.objects.filter(name__in=names)}
+
+    def import_tags(self, rows, products, tags, counter):
+        """Create the unknown tags of a chunk and link them to the products through
+            the M2M table. tags is the in-memory cache of every tag by name"""
+        tag_names = {name for row in rows for name in row["tags"].split("|")}
+        new_tags = [ProductTag(name=name, slug=slugify(name)) for name in tag_names if name not in tags]
+        if new_tags:
+            ProductTag.objects.bulk_create(new_tags)
+            tags.update((tag.name, tag) for tag in ProductTag.objects.filter(name__in=[t.name for t in new_tags]))
+            counter["tags_created"] += len(new_tags)
+
+        Through = Product.tags.through
+        links = []
+        for row in rows:
+            product = products[(row["name"], Decimal(row["price"]))]
+            for name in row["tags"].split("|"):
+                links.append(Through(product_id=product.id, producttag_id=tags[name].id))
+                counter["tags"] += 1
+        Through.objects.bulk_create(links, ignore_conflicts=True)
+
+    def import_images(self, rows, paths, rendered, products, counter):
+        """Store the original images with the renditions made by the process pool,
+            so the images are ready without going through the thumbnail worker"""
+        renditions = []
+        for row, path, image_renditions in zip(rows, paths, rendered):
+            product = products[(row["name"], Decimal(row["price"]))]
+            built = thumbnails.build_renditions(row["image_filename"], image_renditions)
+
+            image = ProductImage(
+                product=product,
+                thumbnail=thumbnails.default_rendition(built).file.name,
+                thumbnail_status=ProductImage.READY,
+            )
+            # Storing the file before saving keeps the image from being queued for the worker
+            with open(path, "rb") as f:
+                image.image.save(row["image_filename"], ImageFile(f), save=False)
+            image.save()
+
+            for rendition in built:
+                rendition.image = image
+            renditions.extend(built)
+            counter["images"] += 1
+
+        ProductImageRendition.objects.bulk_create(renditions)
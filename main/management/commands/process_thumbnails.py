@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from main import thumbnails
+
+import time
+
+class Command(BaseCommand):
+    help = 'Generate the renditions of uploaded product images'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type = int, default = settings.THUMBNAIL_WORKER_CONCURRENCY,
+                            help = "Number of images processed in parallel")
+        parser.add_argument("--batch-size", type = int, default = 100,
+                            help = "Maximum number of images picked up per poll")
+        parser.add_argument("--interval", type = float, default = 5.0,
+                            help = "Seconds to wait when there is nothing to process")
+        parser.add_argument("--once", action = "store_true",
+                            help = "Process the pending images and exit instead of polling")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.monotonic()
+            processed = thumbnails.process_pending(options["concurrency"], options["batch_size"])
+
+            if processed:
+                elapsed = time.monotonic() - start
+                self.stdout.write(f"Images processed = {processed} ({processed / elapsed:.1f}/s)")
+
+            if processed < options["batch_size"]:
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.models import ChangeLog
+
+class Command(BaseCommand):
+    help = 'Delete the change log entries followed by a later change of the same record'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type = int, default = 10000,
+                            help = "Entries deleted per transaction")
+
+    def handle(self, *args, **options):
+        """The feed only returns the last change of each record, so any cursor
+            still gets every record changed after it. Deletions are kept, a
+            client syncing from an older cursor still has to see them"""
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                ids = list(
+                    ChangeLog.objects.superseded().order_by("id").values_list("id", flat=True)[:options["batch_size"]]
+                )
+                if not ids:
+                    break
+                ChangeLog.objects.filter(pk__in=ids).delete()
+            deleted += len(ids)
+
+        self.stdout.write(f"Change log entries deleted = {deleted}")
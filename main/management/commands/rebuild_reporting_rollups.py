@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+from main.models import DailyOrderCount, DailyProductSales, Order, OrderLine
+
+from datetime import date
+
+class Command(BaseCommand):
+    help = 'Backfill or rebuild the daily rollups read by the admin reports'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type = date.fromisoformat,
+                            help = "Only rebuild the days from this date (YYYY-MM-DD) on")
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        lines = OrderLine.objects.all()
+        order_counts = DailyOrderCount.objects.all()
+        product_sales = DailyProductSales.objects.all()
+
+        if options["since"]:
+            orders = orders.filter(date_added__date__gte=options["since"])
+            lines = lines.filter(order__date_added__date__gte=options["since"])
+            order_counts = order_counts.filter(day__gte=options["since"])
+            product_sales = product_sales.filter(day__gte=options["since"])
+
+        with transaction.atomic():
+            order_counts.delete()
+            product_sales.delete()
+
+            DailyOrderCount.objects.bulk_create(
+                DailyOrderCount(day=row["day"], count=row["c"])
+                for row in orders.annotate(day=TruncDate("date_added")).values("day").annotate(c=Count("id")).order_by()
+            )
+            DailyProductSales.objects.bulk_create(
+                DailyProductSales(day=row["day"], product_id=row["product"], units=row["c"])
+                for row in lines.annotate(day=TruncDate("order__date_added")).values("day", "product").annotate(c=Count("id")).order_by()
+            )
+
+        self.stdout.write(f"Daily order counts = {DailyOrderCount.objects.count()}")
+        self.stdout.write(f"Daily product sales = {DailyProductSales.objects.count()}")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from main import search
+
+import time
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index from the catalog'
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        search.get_backend().rebuild()
+        self.stdout.write(f"Search index rebuilt in {time.monotonic() - start:.2f}s")
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from main import outbox
+
+import time
+
+class Command(BaseCommand):
+    help = 'Deliver the emails queued in the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type = int, default = 100,
+                            help = "Maximum number of emails sent over one connection")
+        parser.add_argument("--interval", type = float, default = 5.0,
+                            help = "Seconds to wait when there is nothing to send")
+        parser.add_argument("--once", action = "store_true",
+                            help = "Send the due emails and exit instead of polling")
+
+    def handle(self, *args, **options):
+        while True:
+            result = outbox.send_batch(options["batch_size"])
+            handled = result.sent + result.retried + result.failed
+
+            if handled:
+                rate = result.sent / result.seconds if result.seconds else 0
+                self.stdout.write(
+                    f"Emails sent = {result.sent} ({rate:.1f}/s), to retry = {result.retried}, failed = {result.failed}"
+                )
+
+            if handled < options["batch_size"]:
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
@@ -1,16 +1,84 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from . import db_router
+from .baskets import CookieBasket
 from .models import Basket
 
+import logging
+
+logger = logging.getLogger(__name__)
+
+BASKET_SUMMARY_SESSION_KEY = "basket_summary"
+REPLICA_PIN_COOKIE = "replica_pin"
+
+def get_basket(request):
+    """Load the basket referenced by the session, or else the cookie basket of an
+        anonymous visitor. A basket that has been deleted in the meantime is
+        dropped from the session instead of raising"""
+    basket_id = request.session.get('basket_id')
+    if basket_id is None:
+        return CookieBasket.from_request(request)
+
+    try:
+        return Basket.objects.get(id=basket_id)
+    except Basket.DoesNotExist:
+        logger.info(f"Basket id {basket_id} in session no longer exists")
+        del request.session['basket_id']
+        reset_basket_summary(request)
+        return None
+
+def get_basket_summary(request):
+    """Return the small {"count", "total"} summary that templates need, reusing the
+        copy cached in the session while it belongs to the current basket"""
+    basket_id = request.session.get('basket_id')
+    if basket_id is None:
+        # The cookie basket carries its own summary
+        return request.basket.summary() if request.basket else None
+
+    summary = request.session.get(BASKET_SUMMARY_SESSION_KEY)
+    if summary and summary.get("basket_id") == basket_id:
+        return summary
+
+    if not request.basket:
+        return None
+
+    summary = dict(request.basket.summary(), basket_id=basket_id)
+    request.session[BASKET_SUMMARY_SESSION_KEY] = summary
+    return summary
+
+def reset_basket_summary(request):
+    """Forget the cached summary. Has to be called whenever the basket lines change"""
+    request.session.pop(BASKET_SUMMARY_SESSION_KEY, None)
+
 def basket_middleware(get_response):
-    """Checks the session to see if a basket exists for every view request"""
+    """Attaches the session basket to every view request. Both the basket and its
+        summary are lazy, so requests that never use them don't hit the database.
+        A cookie basket changed by the view is written back to its cookie"""
     def middleware(request):
-        if 'basket_id' in request.session:
-            basket_id = request.session['basket_id']
-            basket = Basket.objects.get(id=basket_id)
-            request.basket = basket
-        else:
-            request.basket = None
-        
+        request.basket = SimpleLazyObject(lambda: get_basket(request))
+        request.basket_summary = SimpleLazyObject(lambda: get_basket_summary(request))
+        request.cookie_basket = None
+
         # Use the in-built get_response() function to pass the request along after adding the basket
-        response = get_response(request) 
+        response = get_response(request)
+
+        if request.cookie_basket is not None and request.cookie_basket.modified:
+            request.cookie_basket.set_cookie(response)
+        return response
+    return middleware
+
+def replica_pin_middleware(get_response):
+    """Keeps a client that wrote to the database on the primary for
+        REPLICA_PIN_SECONDS, with a cookie, so the views reading from the
+        replica show its own writes even while the replica lags behind"""
+    def middleware(request):
+        with db_router.request_state(pinned=REPLICA_PIN_COOKIE in request.COOKIES) as state:
+            response = get_response(request)
+
+        if state.wrote:
+            response.set_cookie(
+                REPLICA_PIN_COOKIE, "1", max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite="Lax"
+            )
         return response
     return middleware
@@ -0,0 +1,39 @@
+# Generated by Django 3.0.5 on 2026-10-18 10:23
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def compute_basket_totals(apps, schema_editor):
+    Basket = apps.get_model('main', 'Basket')
+    BasketLine = apps.get_model('main', 'BasketLine')
+
+    lines = BasketLine.objects.filter(basket=OuterRef('pk')).order_by().values('basket')
+    line_total = ExpressionWrapper(F('quantity') * F('product__price'), output_field=DecimalField())
+    Basket.objects.update(
+        item_count=Coalesce(Subquery(lines.annotate(c=Sum('quantity')).values('c')), 0),
+        subtotal=Coalesce(Subquery(lines.annotate(t=Sum(line_total)).values('t')), Decimal('0.00')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_auto_20200411_2206'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basket',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=10),
+        ),
+        migrations.RunPython(compute_basket_totals, migrations.RunPython.noop),
+    ]
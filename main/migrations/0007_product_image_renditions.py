@@ -0,0 +1,35 @@
+# Generated by Django 3.0.5 on 2026-10-18 10:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_basket_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='thumbnail_status',
+            field=models.IntegerField(choices=[(10, 'Pending'), (20, 'Processing'), (30, 'Ready'), (40, 'Failed')], default=10, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ProductImageRendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('file', models.ImageField(upload_to='product-renditions')),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='main.ProductImage')),
+            ],
+            options={
+                'verbose_name': 'Product Image Rendition',
+                'verbose_name_plural': 'Product Image Renditions',
+                'unique_together': {('image', 'name')},
+            },
+        ),
+    ]
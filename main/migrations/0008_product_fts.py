@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+def create_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS main_product_fts "
+        "USING fts5(name, description, tags, tokenize='porter unicode61', prefix='2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO main_product_fts (rowid, name, description, tags) "
+        "SELECT p.id, p.name, p.description, "
+        "COALESCE((SELECT group_concat(t.name, ' ') FROM main_producttag t "
+        "JOIN main_product_tags pt ON pt.producttag_id = t.id "
+        "WHERE pt.product_id = p.id), '') "
+        "FROM main_product p"
+    )
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS main_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_product_image_renditions'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.0.5 on 2026-10-18 10:31
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def backfill_rollups(apps, schema_editor):
+    Order = apps.get_model('main', 'Order')
+    OrderLine = apps.get_model('main', 'OrderLine')
+    DailyOrderCount = apps.get_model('main', 'DailyOrderCount')
+    DailyProductSales = apps.get_model('main', 'DailyProductSales')
+
+    DailyOrderCount.objects.bulk_create(
+        DailyOrderCount(day=row['day'], count=row['c'])
+        for row in Order.objects.annotate(day=TruncDate('date_added')).values('day').annotate(c=Count('id')).order_by()
+    )
+    DailyProductSales.objects.bulk_create(
+        DailyProductSales(day=row['day'], product_id=row['product'], units=row['c'])
+        for row in OrderLine.objects.annotate(day=TruncDate('order__date_added')).values('day', 'product').annotate(c=Count('id')).order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_product_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOrderCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Daily order count',
+                'verbose_name_plural': 'Daily order counts',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Product')),
+            ],
+            options={
+                'verbose_name': 'Daily product sales',
+                'verbose_name_plural': 'Daily product sales',
+                'unique_together': {('day', 'product')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_reporting_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderline',
+            name='date_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.0.5 on 2026-10-18 10:39
+
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def backfill_email_lookup(apps, schema_editor):
+    User = apps.get_model('main', 'User')
+    User.objects.update(email_lookup=Lower('email'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_change_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='email_lookup',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=254),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'date_added'], name='order_status_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'date_updated'], name='order_status_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['date_added'], name='order_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['date_updated'], name='order_updated_idx'),
+        ),
+        migrations.RunPython(backfill_email_lookup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.0.5 on 2026-10-18 10:44
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.template.defaultfilters import slugify
+
+
+def dedupe_tag_slugs(apps, schema_editor):
+    # Tags imported without a slug get one from their name. Tags sharing a slug
+    # keep it on the oldest one, the others get their id appended
+    ProductTag = apps.get_model('main', 'ProductTag')
+    for tag in ProductTag.objects.filter(slug=''):
+        tag.slug = slugify(tag.name) or str(tag.id)
+        tag.save(update_fields=['slug'])
+
+    duplicated = ProductTag.objects.values('slug').annotate(c=Count('id')).filter(c__gt=1).values_list('slug', flat=True)
+    for tag in ProductTag.objects.filter(slug__in=list(duplicated)).order_by('slug', 'id'):
+        if ProductTag.objects.filter(slug=tag.slug, id__lt=tag.id).exists():
+            # Shortened so the suffix fits in the 48 characters of the column
+            suffix = f"-{tag.id}"
+            tag.slug = f"{tag.slug[:48 - len(suffix)]}{suffix}"
+            tag.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_order_dashboard_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_tag_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='producttag',
+            name='slug',
+            field=models.SlugField(max_length=48, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='basket',
+            index=models.Index(fields=['user', 'status'], name='basket_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'id'], name='order_status_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderline',
+            index=models.Index(fields=['order', 'status'], name='orderline_order_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['active', 'name'], name='product_active_name_idx'),
+        ),
+    ]
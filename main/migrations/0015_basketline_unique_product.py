@@ -0,0 +1,32 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:01
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # Lines of the same product in a basket are folded into the oldest one
+    BasketLine = apps.get_model('main', 'BasketLine')
+    duplicated = BasketLine.objects.values('basket', 'product').annotate(
+        c=Count('id'), first=Min('id'), total=Sum('quantity')
+    ).filter(c__gt=1)
+    for group in duplicated:
+        BasketLine.objects.filter(pk=group['first']).update(quantity=group['total'])
+        BasketLine.objects.filter(
+            basket=group['basket'], product=group['product']
+        ).exclude(pk=group['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_outgoing_email'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='basketline',
+            constraint=models.UniqueConstraint(fields=('basket', 'product'), name='basketline_basket_product_uniq'),
+        ),
+    ]
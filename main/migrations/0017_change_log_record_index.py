@@ -0,0 +1,17 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_import_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['resource', 'object_id'], name='changelog_record_idx'),
+        ),
+    ]
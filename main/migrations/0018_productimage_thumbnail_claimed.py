@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_change_log_record_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='thumbnail_claimed',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:16
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.template.defaultfilters import slugify
+
+
+def dedupe_product_slugs(apps, schema_editor):
+    # Same as the tags: products without a slug get one from their name, products
+    # sharing a slug keep it on the oldest one, the others get their id appended
+    Product = apps.get_model('main', 'Product')
+    for product in Product.objects.filter(slug=''):
+        product.slug = slugify(product.name) or str(product.id)
+        product.save(update_fields=['slug'])
+
+    duplicated = Product.objects.values('slug').annotate(c=Count('id')).filter(c__gt=1).values_list('slug', flat=True)
+    for product in Product.objects.filter(slug__in=list(duplicated)).order_by('slug', 'id'):
+        if Product.objects.filter(slug=product.slug, id__lt=product.id).exists():
+            # Shortened so the suffix fits in the 48 characters of the column
+            suffix = f"-{product.id}"
+            product.slug = f"{product.slug[:48 - len(suffix)]}{suffix}"
+            product.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_productimage_thumbnail_claimed'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_product_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=models.SlugField(max_length=48, unique=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:25
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def position_existing_entries(apps, schema_editor):
+    # The cursors handed out so far were ids, they stay valid as positions
+    ChangeLog = apps.get_model('main', 'ChangeLog')
+    ChangeLog.objects.update(position=F('id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0019_product_slug_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changelog',
+            name='position',
+            field=models.BigIntegerField(editable=False, null=True, unique=True),
+        ),
+        migrations.RunPython(position_existing_entries, migrations.RunPython.noop),
+    ]
@@ -1,28 +1,133 @@
-from django.db import models
-from django.db.models.signals import pre_save, post_save
-from django.core.files.base import ContentFile
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Case, DecimalField, Exists, ExpressionWrapper, F, IntegerField, OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.core.validators import MinValueValidator
-from django.dispatch import receiver
+from django.dispatch import Signal, receiver
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.contrib.auth.signals import user_logged_in
+from django.template.defaultfilters import slugify
+from django.utils import timezone
 
 import logging
-from io import BytesIO
+from contextlib import contextmanager
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from decimal import Decimal
+from functools import reduce
+from operator import or_
 
 from .exceptions import BasketException
 
-from PIL import Image
-
 logger = logging.getLogger(__name__)
 
+# Sent with the ids of the orders that OrderQuerySet.rollup_status() marked as done,
+# as that UPDATE doesn't send post_save
+orders_rolled_up = Signal()
+# Sent with the ids of the lines OrderLineQuerySet.set_status() changed and their new status
+order_lines_updated = Signal()
+
+@contextmanager
+def deferred_block(pending_var, flush):
+    """Collect into a set, held by the pending_var ContextVar, the ids that the
+        receivers record inside the block and call flush(ids) once when the
+        block exits. Nested blocks share the outermost collection"""
+    pending = pending_var.get()
+    if pending is not None:
+        yield pending
+        return
+
+    pending = set()
+    token = pending_var.set(pending)
+    try:
+        yield pending
+    finally:
+        pending_var.reset(token)
+
+    if pending:
+        flush(pending)
+
+
 class ActiveManager(models.Manager):
     def active(self):
         return self.filter(active=True)
 
+    def unique_slug(self, name, reserved=()):
+        """A slug from name that no product has, numbered from -2 on when taken.
+            reserved holds the slugs of products not saved yet"""
+        base = slugify(name) or "product"
+        taken = set(self.filter(slug__startswith=base).values_list("slug", flat=True)) | set(reserved)
+        slug, number = base, 2
+        while slug in taken:
+            slug = f"{base}-{number}"
+            number += 1
+        return slug
+
 class ProductTagManager(models.Manager):
     def get_by_natural_key(self, slug):
         return self.get(slug=slug)
 
+class OrderQuerySet(models.QuerySet):
+    def rollup_status(self):
+        """Mark as done, in a single UPDATE, every order of the queryset that has
+            lines and none of them below the "sent" status. Returns the number
+            of orders that changed. When orders_rolled_up has receivers the ids
+            are selected first, so they can be sent along"""
+        lines = OrderLine.objects.filter(order=OuterRef("pk"))
+        done = self.exclude(status=Order.DONE).filter(
+            Exists(lines), ~Exists(lines.filter(status__lt=OrderLine.SENT))
+        )
+        if not orders_rolled_up.has_listeners(Order):
+            return done.update(status=Order.DONE, date_updated=timezone.now())
+
+        order_ids = list(done.values_list("pk", flat=True))
+        if not order_ids:
+            return 0
+        updated = done.filter(pk__in=order_ids).update(status=Order.DONE, date_updated=timezone.now())
+        orders_rolled_up.send(sender=Order, order_ids=order_ids)
+        return updated
+
+class OrderLineQuerySet(models.QuerySet):
+    def set_status(self, status):
+        """Update the status of all the lines in the queryset and roll up the
+            status of the orders they belong to, once per order"""
+        with transaction.atomic():
+            lines = dict(self.values_list("id", "order_id"))
+            return self._apply_statuses(lines, {status: list(lines)})
+
+    def set_statuses(self, statuses):
+        """Like set_status() with a status per line, statuses mapping line ids to
+            statuses. Runs one UPDATE per distinct status and rolls up each
+            order once. Ids missing from the queryset are ignored. Returns the
+            ids of the lines updated"""
+        with transaction.atomic():
+            lines = dict(self.filter(pk__in=statuses).values_list("id", "order_id"))
+            by_status = defaultdict(list)
+            for line_id in lines:
+                by_status[statuses[line_id]].append(line_id)
+            self._apply_statuses(lines, by_status)
+        return list(lines)
+
+    def _apply_statuses(self, lines, by_status):
+        now = timezone.now()
+        updated = 0
+        for status, line_ids in by_status.items():
+            updated += OrderLine.objects.filter(pk__in=line_ids).update(status=status, date_updated=now)
+            order_lines_updated.send(sender=OrderLine, line_ids=line_ids, status=status)
+        Order.objects.filter(pk__in=set(lines.values())).rollup_status()
+        return updated
+
+class BasketQuerySet(models.QuerySet):
+    def update_totals(self):
+        """Recompute item_count and subtotal of every basket in the queryset
+            from its lines, in a single UPDATE"""
+        lines = BasketLine.objects.filter(basket=OuterRef("pk")).order_by().values("basket")
+        line_total = ExpressionWrapper(F("quantity") * F("product__price"), output_field=DecimalField())
+        return self.update(
+            item_count=Coalesce(Subquery(lines.annotate(c=Sum("quantity")).values("c")), 0),
+            subtotal=Coalesce(Subquery(lines.annotate(t=Sum(line_total)).values("t")), Decimal("0.00")),
+        )
+
 class UserManager(BaseUserManager):
     use_in_migrations = True
 
@@ -58,23 +163,30 @@ class UserManager(BaseUserManager):
 class User(AbstractUser):
     username = None
     email = models.EmailField('email address', unique=True)
+    # Lowercased copy of the email, indexed for the lookups of the order dashboard.
+    # On PostgreSQL db_index adds a varchar_pattern_ops index for the prefix matches
+    email_lookup = models.CharField(max_length=254, db_index=True, editable=False, default="")
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
     objects = UserManager()
 
+    def save(self, *args, **kwargs):
+        self.email_lookup = self.email.lower()
+        super().save(*args, **kwargs)
+
     @property
     def is_employee(self):
-        return self.is_active and (self.is_superuser or self.is_staff and self.groups.filter(name="Employees").exits())
+        return self.is_active and (self.is_superuser or self.is_staff and self.groups.filter(name="Employees").exists())
 
     @property
     def is_dispatcher(self):
-        return self.is_active and (self.is_superuser or self.is_staff and self.groups.filter(name="Dispatchers").exits())
+        return self.is_active and (self.is_superuser or self.is_staff and self.groups.filter(name="Dispatchers").exists())
 
 class ProductTag(models.Model):
     name = models.CharField(max_length=32)
-    slug = models.SlugField(max_length = 48)
+    slug = models.SlugField(max_length = 48, unique=True) # Natural key of the tags
     active = models.BooleanField(default=True)
     description = models.TextField(blank=True)
 
@@ -96,7 +208,7 @@ class Product(models.Model):
     tags = models.ManyToManyField(ProductTag, blank=True)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=6, decimal_places=2)
-    slug = models.SlugField(max_length = 48)
+    slug = models.SlugField(max_length = 48, unique=True) # Looked up by the product page
     active = models.BooleanField(default=True)
     in_stock = models.BooleanField(default=True)
     date_updated = models.DateTimeField(auto_now=True)
@@ -107,14 +219,26 @@ class Product(models.Model):
     class Meta:
         verbose_name = "Product"
         verbose_name_plural = "Products"
+        # The listing pages filter on active and sort by name
+        indexes = [models.Index(fields=["active", "name"], name="product_active_name_idx")]
 
     def __str__(self):
         return self.name
 
 class ProductImage(models.Model):
+    PENDING = 10
+    PROCESSING = 20
+    READY = 30
+    FAILED = 40
+
+    STATUSES = ((PENDING, "Pending"), (PROCESSING, "Processing"), (READY, "Ready"), (FAILED, "Failed"))
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     image = models.ImageField(upload_to="product-images")
     thumbnail = models.ImageField(upload_to="product-thumbnails", null=True)
+    thumbnail_status = models.IntegerField(choices=STATUSES, default=PENDING, editable=False)
+    # When a worker moved the image to processing, see thumbnails.claimable()
+    thumbnail_claimed = models.DateTimeField(null=True, editable=False)
 
     class Meta:
         verbose_name = "Product Image"
@@ -123,23 +247,45 @@ class ProductImage(models.Model):
     def __str__(self):
         return self.product.name
 
-THUMBNAIL_SIZE = (300,300)
-
-@receiver(pre_save,sender=ProductImage)
-def generate_thumbnail(sender, instance, **kwargs):
-    logger.info(f"Generating thumbnail for image {instance.product.id}")
-    
+    @property
+    def thumbnail_url(self):
+        """Templates fall back to the original image until the worker has made the thumbnail"""
+        if self.thumbnail:
+            return self.thumbnail.url
+        return self.image.url
+
+    def rendition_url(self, name):
+        """URL of a named rendition (see settings.THUMBNAIL_RENDITIONS), or of the original image"""
+        if self.thumbnail_status == ProductImage.READY:
+            for rendition in self.renditions.all():
+                if rendition.name == name:
+                    return rendition.file.url
+        return self.image.url
+
+class ProductImageRendition(models.Model):
+    """A resized copy of a ProductImage, produced by the process_thumbnails worker"""
+    image = models.ForeignKey(ProductImage, on_delete=models.CASCADE, related_name="renditions")
+    name = models.CharField(max_length=32)
+    file = models.ImageField(upload_to="product-renditions")
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
 
-    image = Image.open(instance.image)
-    image = image.convert("RGB")
-    image.thumbnail(THUMBNAIL_SIZE, Image.ANTIALIAS)
+    class Meta:
+        verbose_name = "Product Image Rendition"
+        verbose_name_plural = "Product Image Renditions"
+        unique_together = (("image", "name"),)
 
-    temp_thumb = BytesIO()
-    image.save(temp_thumb,'JPEG')
-    temp_thumb.seek(0) 
+    def __str__(self):
+        return f"{self.image} ({self.name})"
 
-    instance.thumbnail.save(instance.image.name,ContentFile(temp_thumb.read()), save=False,)
-    temp_thumb.close()
+@receiver(pre_save,sender=ProductImage)
+def queue_thumbnail(sender, instance, **kwargs):
+    """A newly uploaded image only gets queued here, the resizing is left to the
+        process_thumbnails worker so saving doesn't block on PIL"""
+    if not instance.image._committed:
+        logger.info(f"Queueing thumbnails for image of product {instance.product_id}")
+        instance.thumbnail = None
+        instance.thumbnail_status = ProductImage.PENDING
 
 
 class Address(models.Model):
@@ -175,19 +321,95 @@ class Basket(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, blank=True, null=True)
     status = models.IntegerField(choices=STATUSES, default=OPEN)
 
+    # Denormalized from the basket lines by BasketQuerySet.update_totals()
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal("0.00"), editable=False)
+
+    objects = BasketQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Basket"
         verbose_name_plural = "Baskets"
+        # Open basket of a user, looked up on login by merge_baskets_if_found
+        indexes = [models.Index(fields=["user", "status"], name="basket_user_status_idx")]
 
     def is_empty(self):
-        return self.basketline_set.all().count() == 0
+        return self.item_count == 0
 
     def count(self):
-        return sum(i.quantity for i in self.basketline_set.all())
+        return self.item_count
+
+    def refresh_totals(self):
+        """Reload the denormalized totals after the lines have been changed"""
+        self.refresh_from_db(fields=["item_count", "subtotal"])
+
+    def summary(self):
+        """Item count and total price of the basket. The total is a string so
+            the summary can be stored in the session"""
+        return {
+            "count": self.item_count,
+            "total": str(self.subtotal),
+        }
 
     def __str__(self):
         return self.user.email
 
+    def add_product(self, product, quantity=1):
+        """Add quantity of product and return the new quantity of its line. The
+            increment happens in the database, so concurrent adds are never
+            lost, and the unique constraint on the lines settles two requests
+            creating the line of the same product at once"""
+        lines = BasketLine.objects.filter(basket=self.pk, product=product)
+        with transaction.atomic():
+            with deferred_basket_totals() as pending:
+                pending.add(self.pk)
+                if not lines.update(quantity=F("quantity") + quantity):
+                    try:
+                        with transaction.atomic():
+                            BasketLine.objects.create(basket=self, product=product, quantity=quantity)
+                    except IntegrityError:
+                        # Created by a concurrent request since the update
+                        lines.update(quantity=F("quantity") + quantity)
+            line_quantity = lines.values_list("quantity", flat=True).get()
+        self.refresh_totals()
+        return line_quantity
+
+    def set_quantities(self, quantities):
+        """Apply {product_id: quantity} to the lines of the basket in one
+            transaction, a quantity of 0 removing the line. The number of
+            queries doesn't depend on the number of changes. Returns the ids of
+            the products that had a line"""
+        lines = BasketLine.objects.filter(basket=self.pk, product__in=list(quantities))
+        with transaction.atomic(), deferred_basket_totals() as pending:
+            pending.add(self.pk)
+            found = set(lines.values_list("product_id", flat=True))
+            changed = {product_id: q for product_id, q in quantities.items() if product_id in found and q > 0}
+            if changed:
+                lines.filter(product__in=list(changed)).update(quantity=Case(
+                    *[When(product=product_id, then=q) for product_id, q in changed.items()],
+                    output_field=IntegerField(),
+                ))
+            if len(changed) < len(found):
+                lines.exclude(product__in=list(changed)).delete()
+        self.refresh_totals()
+        return found
+
+    def merge(self, other):
+        """Move the lines of the other basket into this one and delete it, with a
+            fixed number of queries whatever the size of the baskets. Quantities
+            of the products in both are added up, so each product keeps a single line"""
+        with transaction.atomic(), deferred_basket_totals() as pending:
+            pending.add(self.pk)
+            other_lines = BasketLine.objects.filter(basket=other.pk)
+            same_product = other_lines.filter(product=OuterRef("product")).order_by().values("product")
+            shared = self.basketline_set.filter(Exists(same_product))
+
+            shared.update(quantity=F("quantity") + Subquery(same_product.annotate(q=Sum("quantity")).values("q")))
+            other_lines.filter(Exists(self.basketline_set.filter(product=OuterRef("product")))).delete()
+            other_lines.update(basket=self.pk)
+            Basket.objects.filter(pk=other.pk).delete()
+        self.refresh_totals()
+
     def create_order(self, billing_address, shipping_address):
         if not self.user:
             raise BasketException("Cannot create order without user")
@@ -210,20 +432,26 @@ class Basket(models.Model):
             "shipping_country": shipping_address.country
         }
 
-        order = Order.objects.create(**order_data)
-        c = 0
-        for line in self.basketline_set.all():
-            for _ in range(line.quantity):
-                order_line_data = {
-                    "order": order,
-                    "product": line.product
-                }
-                order_line = OrderLine.objects.create(**order_line_data)
-                c += 1
-        logger.info(f"Created order with id={order.id} and lines_count={c}")
-        
-        self.status = Basket.SUBMITTED
-        self.save()
+        # The order and all of its lines are written in one transaction. Lines are
+        # inserted with a single bulk_create so the statement count doesn't grow with quantity
+        with transaction.atomic():
+            order = Order.objects.create(**order_data)
+            order_lines = [
+                OrderLine(order=order, product_id=line.product_id)
+                for line in self.basketline_set.all()
+                for _ in range(line.quantity)
+            ]
+            OrderLine.objects.bulk_create(order_lines)
+            # bulk_create skips the post_save receiver that maintains the reporting rollup
+            day = rollup_day(order.date_added)
+            DailyProductSales.objects.record(Counter((day, line.product_id) for line in order_lines))
+            # and the change log, which needs the ids bulk_create doesn't return on every backend
+            ChangeLog.objects.record(ChangeLog.ORDERLINE, order.lines.values_list("id", flat=True))
+
+            self.status = Basket.SUBMITTED
+            self.save(update_fields=["status"])
+
+        logger.info(f"Created order with id={order.id} and lines_count={len(order_lines)}")
         return order
 
 
@@ -233,25 +461,69 @@ class BasketLine(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)])
 
+    class Meta:
+        # One line per product, Basket.add_product relies on it under concurrent adds
+        constraints = [models.UniqueConstraint(fields=["basket", "product"], name="basketline_basket_product_uniq")]
+
+
+_deferred_totals = ContextVar("deferred_basket_totals", default=None)
+
+def deferred_basket_totals():
+    """Collect the baskets whose lines are saved or deleted inside the block and
+        update their totals once each when the block exits. Queryset updates
+        and bulk_create don't send signals, their basket has to be added to
+        the yielded set"""
+    return deferred_block(
+        _deferred_totals, lambda pending: Basket.objects.filter(pk__in=pending).update_totals()
+    )
+
+
+@receiver(post_save, sender=BasketLine)
+@receiver(post_delete, sender=BasketLine)
+def basketline_to_basket_totals(sender, instance, **kwargs):
+    """Keep the basket item count and subtotal in step with its lines. Inside a
+        deferred_basket_totals() block the basket is only recorded"""
+    pending = _deferred_totals.get()
+    if pending is not None:
+        pending.add(instance.basket_id)
+        return
+
+    Basket.objects.filter(pk=instance.basket_id).update_totals()
+
+
+@receiver(post_save, sender=Product)
+def product_price_to_basket_totals(sender, instance, update_fields=None, **kwargs):
+    """A price change alters the subtotal of the open baskets holding the product"""
+    if update_fields is not None and "price" not in update_fields:
+        return
+    Basket.objects.filter(status=Basket.OPEN, basketline__product=instance).update_totals()
+
 
 """Signal to merge a user's previous basket with their current basket if it exists"""
 @receiver(user_logged_in)
 def merge_baskets_if_found(sender, user, request, **kwargs):
     anonymous_basket = getattr(request, "basket", None) # Get the basket attrib from the request if it exists or None
-    if anonymous_basket:
-        try:
-            loggedin_basket = Basket.objects.get(user=user, status=Basket.OPEN) # Get user's current logged in basket
-            for line in anonymous_basket.basketline_set.all(): # For each item in the anonymous basket add it to the current basket
-                line.basket = loggedin_basket
-                line.save()
-
-            anonymous_basket.delete()
+    if anonymous_basket and not isinstance(anonymous_basket, Basket):
+        # A cookie basket (main.baskets), its lines are written straight to the user's basket
+        loggedin_basket = anonymous_basket.to_basket(user)
+        request.basket = loggedin_basket
+        request.session['basket_id'] = loggedin_basket.id
+        request.session.pop("basket_summary", None)
+    elif anonymous_basket:
+        # Get user's current logged in basket, the session basket may already be it
+        loggedin_basket = Basket.objects.filter(
+            user=user, status=Basket.OPEN
+        ).exclude(pk=anonymous_basket.pk).order_by("pk").first()
+        if loggedin_basket:
+            loggedin_basket.merge(anonymous_basket)
             request.basket = loggedin_basket # Set the request (session) basket to the logged in basket after adding old items
+            request.session['basket_id'] = loggedin_basket.id
+            request.session.pop("basket_summary", None)
             logger.info(f"Merged basket to id {loggedin_basket.id}")
 
-        except Basket.DoesNotExist:
+        elif anonymous_basket.user_id != user.id:
             anonymous_basket.user = user
-            anonymous_basket.save()
+            anonymous_basket.save(update_fields=["user"])
 
             logger.info(f"Assigned user to basket with id {anonymous_basket.id}")
 
@@ -283,9 +555,34 @@ class Order(models.Model):
     date_updated = models.DateTimeField(auto_now=True)
     date_added = models.DateTimeField(auto_now_add=True)
 
+    objects = OrderQuerySet.as_manager()
+
+    _loaded_status = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the status the order was loaded with, so receivers can tell
+            status changes apart without querying the database again"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get("status")
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_status = self.status
+
     class Meta:
         verbose_name = "Order"
         verbose_name_plural = "Orders"
+        # The order dashboard filters date ranges with or without a status
+        indexes = [
+            models.Index(fields=["status", "date_added"], name="order_status_added_idx"),
+            models.Index(fields=["status", "date_updated"], name="order_status_updated_idx"),
+            models.Index(fields=["date_added"], name="order_added_idx"),
+            models.Index(fields=["date_updated"], name="order_updated_idx"),
+            # Paid orders newest first by id, as paged by the API and the dispatchers admin
+            models.Index(fields=["status", "id"], name="order_status_id_idx"),
+        ]
 
 
 class OrderLine(models.Model):
@@ -299,16 +596,218 @@ class OrderLine(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="lines") # related_name is used to refer to the Order ForeignKey queryset and can be used as order.lines.all() instead of order.orderline_set.all()
     product = models.ForeignKey(Product, on_delete=models.PROTECT) # Protect the corresponding Product if the product instance is deleted in the order
     status = models.IntegerField(choices=STATUSES, default = NEW)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    objects = OrderLineQuerySet.as_manager()
+
+    class Meta:
+        # Lines of an order below a status, as checked by the order status rollup
+        indexes = [models.Index(fields=["order", "status"], name="orderline_order_status_idx")]
+
+
+_deferred_rollup = ContextVar("deferred_order_rollup", default=None)
+
+def deferred_order_rollup():
+    """Collect the orders touched by OrderLine saves inside the block and roll up
+        their status once each when the block exits, instead of once per line"""
+    return deferred_block(_deferred_rollup, _rollup_orders)
+
+def _rollup_orders(order_ids):
+    logger.info(f"Rolling up status for orders {sorted(order_ids)}")
+    Order.objects.filter(pk__in=order_ids).rollup_status()
 
 
 @receiver(post_save, sender=OrderLine)
 def orderline_to_order_status(sender, instance, **kwargs):
     """This signal will be executed after saving instances of the OrderLine
-        model. The first thing it does is check whether any order lines connected
-        to the order have statuses below “sent.” If there is any, the execution is
-        terminated. If there is no line below the “sent” status, the whole order is
-        marked as “done.”"""
-    if not instance.order.lines.filter(status__lt=OrderLine.SENT).exists():
-        logger.info(f"All lines for order {instance.order.id} have been processed. Marking as done")
-        instance.order.status = Order.DONE
-        instance.order.save()
\ No newline at end of file
+        model. If all the lines connected to the order are at least "sent" the
+        whole order is marked as "done". Inside a deferred_order_rollup() block
+        the order is only recorded, and rolled up once when the block exits"""
+    pending = _deferred_rollup.get()
+    if pending is not None:
+        pending.add(instance.order_id)
+        return
+
+    if Order.objects.filter(pk=instance.order_id).rollup_status():
+        logger.info(f"All lines for order {instance.order_id} have been processed. Marking as done")
+
+
+class DailyOrderCountManager(models.Manager):
+    def record(self, counts):
+        """Add counts, a {day: orders} mapping, to the rollup with one INSERT
+            for the missing days and one UPDATE"""
+        if not counts:
+            return
+        self.bulk_create([self.model(day=day) for day in counts], ignore_conflicts=True)
+        self.filter(day__in=counts).update(count=Case(
+            *[When(day=day, then=F("count") + n) for day, n in counts.items()],
+            output_field=IntegerField(),
+        ))
+
+class DailyProductSalesManager(models.Manager):
+    def record(self, units):
+        """Add units, a {(day, product_id): units} mapping, to the rollup with one
+            INSERT for the missing rows and one UPDATE"""
+        if not units:
+            return
+        self.bulk_create([self.model(day=day, product_id=product_id) for day, product_id in units], ignore_conflicts=True)
+        self.filter(reduce(or_, [Q(day=day, product_id=product_id) for day, product_id in units])).update(units=Case(
+            *[When(day=day, product_id=product_id, then=F("units") + n) for (day, product_id), n in units.items()],
+            output_field=IntegerField(),
+        ))
+
+class DailyOrderCount(models.Model):
+    """Reporting rollup of the number of orders added per day"""
+    day = models.DateField(unique=True)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = DailyOrderCountManager()
+
+    class Meta:
+        verbose_name = "Daily order count"
+        verbose_name_plural = "Daily order counts"
+
+class DailyProductSales(models.Model):
+    """Reporting rollup of the units of each product ordered per day"""
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    units = models.PositiveIntegerField(default=0)
+
+    objects = DailyProductSalesManager()
+
+    class Meta:
+        verbose_name = "Daily product sales"
+        verbose_name_plural = "Daily product sales"
+        unique_together = (("day", "product"),)
+
+
+def rollup_day(value):
+    """The day an order counts for, in the current time zone like TruncDay"""
+    if timezone.is_naive(value):
+        return value.date()
+    return timezone.localdate(value)
+
+
+"""The rollups are maintained as orders and lines are created. Changes to
+    existing orders are not tracked, the rebuild_reporting_rollups command
+    recomputes the rollups from the orders when needed"""
+@receiver(post_save, sender=Order)
+def order_to_daily_rollup(sender, instance, created, **kwargs):
+    if created:
+        DailyOrderCount.objects.record({rollup_day(instance.date_added): 1})
+
+@receiver(post_save, sender=OrderLine)
+def orderline_to_daily_rollup(sender, instance, created, **kwargs):
+    if created:
+        day = rollup_day(instance.order.date_added)
+        DailyProductSales.objects.record({(day, instance.product_id): 1})
+
+
+# Key of the PostgreSQL advisory lock taken while numbering the change log
+CHANGE_LOG_LOCK = 0x43484c47
+
+class ChangeLogManager(models.Manager):
+    def record(self, resource, object_ids, deleted=False):
+        """Append a change of every object in object_ids with a single INSERT.
+            The entries get their position once the transaction commits"""
+        self.bulk_create([
+            self.model(resource=resource, object_id=object_id, deleted=deleted)
+            for object_id in object_ids
+        ])
+        transaction.on_commit(self.sequence, using=self.db)
+
+    def sequence(self):
+        """Give the committed entries without a position the next positions, in
+            the order of their ids. Entries of transactions still running are
+            not visible yet, so they are numbered after the ones that committed
+            before them, and a cursor never moves past a change that commits
+            later. Only this short step is serialized, with a lock on
+            PostgreSQL, SQLite allows a single writer anyway"""
+        unpositioned = self.filter(position__isnull=True)
+        first_id = unpositioned.order_by("id").values("id")[:1]
+        last_position = self.filter(position__isnull=False).order_by("-position").values("position")[:1]
+        with transaction.atomic(using=self.db):
+            connection = connections[self.db]
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s)", [CHANGE_LOG_LOCK])
+            # A single statement, its subqueries see the same rows as the UPDATE
+            return unpositioned.update(
+                position=F("id") - Subquery(first_id) + Coalesce(Subquery(last_position), 0) + 1
+            )
+
+    def superseded(self):
+        """The entries followed by a later change of the same record, which the
+            feed never returns"""
+        later = self.filter(resource=OuterRef("resource"), object_id=OuterRef("object_id"), id__gt=OuterRef("id"))
+        return self.filter(Exists(later))
+
+class ChangeLog(models.Model):
+    """Append-only log of the changes to orders and order lines, read by the
+        delta-sync feed. Its position, given in commit order by
+        ChangeLogManager.sequence(), is the high-water mark clients sync from"""
+    ORDER = "order"
+    ORDERLINE = "orderline"
+
+    RESOURCES = ((ORDER, "Order"), (ORDERLINE, "Order line"))
+
+    resource = models.CharField(max_length=16, choices=RESOURCES)
+    object_id = models.PositiveIntegerField()
+    deleted = models.BooleanField(default=False)
+    position = models.BigIntegerField(null=True, unique=True, editable=False)
+    date_added = models.DateTimeField(auto_now_add=True)
+
+    objects = ChangeLogManager()
+
+    class Meta:
+        verbose_name = "Change log entry"
+        verbose_name_plural = "Change log"
+        # prune_change_log looks up the later changes of each record
+        indexes = [models.Index(fields=["resource", "object_id"], name="changelog_record_idx")]
+
+
+class OutgoingEmail(models.Model):
+    """An email queued by outbox.send_mail() in the request, delivered by the
+        send_queued_email worker. next_attempt is when the worker may pick it
+        up, it is pushed back while a worker holds the email and after each
+        failed attempt"""
+    PENDING = 10
+    SENT = 20
+    FAILED = 30
+
+    STATUSES = ((PENDING, "Pending"), (SENT, "Sent"), (FAILED, "Failed"))
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.TextField() # One address per line
+    status = models.IntegerField(choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    date_added = models.DateTimeField(auto_now_add=True)
+    date_sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Outgoing email"
+        verbose_name_plural = "Outgoing emails"
+        # The worker polls the pending emails that are due
+        indexes = [models.Index(fields=["status", "next_attempt"], name="outgoingemail_due_idx")]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.recipient_list())}"
+
+    def recipient_list(self):
+        return self.recipients.splitlines()
+
+
+class ImportCheckpoint(models.Model):
+    """Rows of a CSV file committed by a bulk run of import_data, which --resume
+        continues after. It is saved in the transaction of each chunk, so a
+        chunk is never committed without its checkpoint"""
+    source = models.CharField(max_length=500, unique=True) # Absolute path of the CSV file
+    rows = models.PositiveIntegerField(default=0)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.source} ({self.rows} rows)"
@@ -0,0 +1,117 @@
+"""Outbound email goes through a table instead of straight to the mail server.
+    send_mail() only stores the email, so a slow or failing server can't hold
+    up or break the request. The send_queued_email worker delivers the due
+    emails in batches over one connection of EMAIL_BACKEND, and retries
+    failures with an exponential backoff up to EMAIL_OUTBOX_MAX_ATTEMPTS"""
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+
+from collections import namedtuple
+from datetime import timedelta
+import logging
+import time
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+BatchResult = namedtuple("BatchResult", ["sent", "retried", "failed", "seconds"])
+
+def send_mail(subject, message, from_email, recipient_list):
+    """Queue an email, same arguments as django.core.mail.send_mail"""
+    email = OutgoingEmail.objects.create(
+        subject=subject, body=message, from_email=from_email, recipients="\n".join(recipient_list)
+    )
+    logger.info(f"Queued email id={email.id}")
+    return email
+
+def claim_batch(limit):
+    """Hold up to limit due emails for EMAIL_OUTBOX_LEASE seconds and return
+        them. An email whose worker died is picked up again once the lease
+        ends. Rows locked by another worker's claim are skipped instead of
+        waited on, which needs SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL)"""
+    now = timezone.now()
+    lease_end = now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE)
+    due = OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING, next_attempt__lte=now).order_by("next_attempt")
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            emails = list(due.select_for_update(skip_locked=True)[:limit])
+            OutgoingEmail.objects.filter(pk__in=[email.pk for email in emails]).update(next_attempt=lease_end)
+        return emails
+
+    # Claimed one at a time, each claim only succeeds if no other worker moved the email
+    emails = []
+    for email in due[:limit]:
+        if OutgoingEmail.objects.filter(pk=email.pk, next_attempt=email.next_attempt).update(next_attempt=lease_end):
+            emails.append(email)
+    return emails
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+def record_failure(email, error):
+    """Schedule the next attempt, or give up after EMAIL_OUTBOX_MAX_ATTEMPTS.
+        Returns True if the email will be retried"""
+    email.attempts += 1
+    email.last_error = f"{type(error).__name__}: {error}"
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        logger.error(f"Giving up on email id={email.id} after {email.attempts} attempts: {email.last_error}")
+        email.status = OutgoingEmail.FAILED
+    else:
+        logger.warning(f"Sending email id={email.id} failed, attempt {email.attempts}: {email.last_error}")
+        email.next_attempt = timezone.now() + retry_delay(email.attempts)
+    email.save(update_fields=["attempts", "last_error", "status", "next_attempt"])
+    return email.status == OutgoingEmail.PENDING
+
+def send_batch(limit=100):
+    """Deliver up to limit due emails over a single connection of the email
+        backend. A failed email doesn't stop the batch, the connection is
+        opened again for the next one. Returns a BatchResult"""
+    start = time.monotonic()
+    emails = claim_batch(limit)
+    sent, retried, failed = [], 0, 0
+    mail_connection = get_connection(fail_silently=False)
+
+    try:
+        for i, email in enumerate(emails):
+            try:
+                # Opens the connection if the previous email closed it, or does nothing
+                mail_connection.open()
+            except Exception as e:
+                # The server can't be reached, which is no fault of the emails. They
+                # are all retried after the first backoff delay without counting an attempt
+                logger.warning(f"Connecting to the mail server failed: {e}")
+                waiting = [queued.pk for queued in emails[i:]]
+                OutgoingEmail.objects.filter(pk__in=waiting).update(next_attempt=timezone.now() + retry_delay(1))
+                retried += len(waiting)
+                break
+
+            message = EmailMessage(
+                email.subject, email.body, email.from_email, email.recipient_list(), connection=mail_connection
+            )
+            try:
+                message.send()
+            except Exception as e:
+                mail_connection.close()
+                if record_failure(email, e):
+                    retried += 1
+                else:
+                    failed += 1
+            else:
+                sent.append(email.pk)
+    finally:
+        mail_connection.close()
+        OutgoingEmail.objects.filter(pk__in=sent).update(
+            status=OutgoingEmail.SENT, date_sent=timezone.now(), last_error=""
+        )
+
+    result = BatchResult(len(sent), retried, failed, time.monotonic() - start)
+    if emails:
+        logger.info(
+            f"Sent {result.sent} emails in {result.seconds:.2f}s, {result.retried} to retry, {result.failed} failed"
+        )
+    return result
@@ -0,0 +1,132 @@
+"""Full-text product search. The backend is chosen with settings.PRODUCT_SEARCH_BACKEND
+    so it can be swapped without touching the views or the signals keeping the
+    index in sync"""
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from collections import namedtuple
+from functools import lru_cache
+import re
+
+from .models import Product, ProductTag
+
+SearchResult = namedtuple("SearchResult", ["ids", "total"])
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return import_string(settings.PRODUCT_SEARCH_BACKEND)()
+
+def _chunks(ids, size=500):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+class SearchBackend:
+    def index(self, product_ids):
+        """Add or refresh the given products in the index"""
+        raise NotImplementedError
+
+    def remove(self, product_ids):
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Index the whole catalog from scratch"""
+        raise NotImplementedError
+
+    def search(self, query, offset=0, limit=20):
+        """Return the ids of the active products matching query, best match first,
+            and the total number of matches"""
+        raise NotImplementedError
+
+class DatabaseSearchBackend(SearchBackend):
+    """Fallback without an index, matching every word of the query with icontains"""
+    def index(self, product_ids):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, query, offset=0, limit=20):
+        products = Product.objects.active()
+        for word in query.split():
+            products = products.filter(
+                Q(name__icontains=word) | Q(description__icontains=word) | Q(tags__name__icontains=word)
+            )
+        ids = products.order_by("name").values_list("id", flat=True).distinct()
+        return SearchResult(list(ids[offset:offset + limit]), ids.count())
+
+class SQLiteFTS5Backend(SearchBackend):
+    """Index kept in an FTS5 virtual table whose rowid is the product id. Results
+        are ranked with bm25, weighting name matches above tags and description"""
+    table = "main_product_fts"
+    weights = (10.0, 1.0, 5.0) # name, description, tags
+
+    def _documents_sql(self):
+        product_table = Product._meta.db_table
+        tag_table = ProductTag._meta.db_table
+        through_table = Product.tags.through._meta.db_table
+        return f"""
+            SELECT p.id, p.name, p.description,
+                   COALESCE((SELECT group_concat(t.name, ' ')
+                             FROM {tag_table} t
+                             JOIN {through_table} pt ON pt.producttag_id = t.id
+                             WHERE pt.product_id = p.id), '')
+            FROM {product_table} p"""
+
+    def index(self, product_ids):
+        with connection.cursor() as cursor:
+            for ids in _chunks(product_ids):
+                placeholders = ", ".join(["%s"] * len(ids))
+                cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", ids)
+                cursor.execute(
+                    f"INSERT INTO {self.table} (rowid, name, description, tags) "
+                    f"{self._documents_sql()} WHERE p.id IN ({placeholders})",
+                    ids,
+                )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            for ids in _chunks(product_ids):
+                placeholders = ", ".join(["%s"] * len(ids))
+                cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", ids)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            cursor.execute(f"INSERT INTO {self.table} (rowid, name, description, tags) {self._documents_sql()}")
+
+    def match_expression(self, query):
+        """Turn free text into an FTS5 query: every word has to match and the last
+            one is matched as a prefix. Words are quoted so user input can't
+            inject FTS5 syntax"""
+        words = [f'"{word}"' for word in re.findall(r"\w+", query)]
+        if words:
+            words[-1] += "*"
+        return " ".join(words)
+
+    def search(self, query, offset=0, limit=20):
+        expression = self.match_expression(query)
+        if not expression:
+            return SearchResult([], 0)
+
+        table = self.table
+        from_sql = (
+            f"FROM {table} JOIN {Product._meta.db_table} p ON p.id = {table}.rowid "
+            f"WHERE {table} MATCH %s AND p.active"
+        )
+        weights = ", ".join(str(w) for w in self.weights)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {table}.rowid {from_sql} ORDER BY bm25({table}, {weights}) LIMIT %s OFFSET %s",
+                [expression, limit, offset],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f"SELECT COUNT(*) {from_sql}", [expression])
+            total = cursor.fetchone()[0]
+        return SearchResult(ids, total)
@@ -1,30 +1,179 @@
-# from django.db.models.signals import pre_save
-# from django.core.files.base import ContentFile
-# from django.dispatch import receiver
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
 
-# import logging
-# from io import BytesIO
+from . import catalog_cache, dispatch, invoices, search
+from .models import ChangeLog, Order, OrderLine, Product, ProductImage, ProductTag, order_lines_updated, orders_rolled_up
 
-# from PIL import Image
+"""Receivers keeping the cached product listings and the search index in step
+    with the catalog. Bulk queryset updates bypass them and have to call
+    catalog_cache and the search backend themselves"""
 
-# from .models import ProductImage
+@receiver(post_save, sender=Product)
+@receiver(pre_delete, sender=Product)
+def product_to_listing_cache(sender, instance, **kwargs):
+    catalog_cache.invalidate_products([instance])
 
-# logger = logging.getLogger(__name__)
+@receiver(pre_save, sender=ProductTag)
+def tag_slug_change_to_listing_cache(sender, instance, **kwargs):
+    instance._previous = None
+    if instance.pk:
+        instance._previous = ProductTag.objects.filter(pk=instance.pk).values("slug", "name").first()
+    if instance._previous and instance._previous["slug"] != instance.slug:
+        catalog_cache.invalidate_tags([instance._previous["slug"]])
 
-# THUMBNAIL_SIZE = (300,300)
+@receiver(post_save, sender=ProductTag)
+@receiver(pre_delete, sender=ProductTag)
+def tag_to_listing_cache(sender, instance, **kwargs):
+    catalog_cache.invalidate_tags([instance.slug])
 
-# @receiver(pre_save,sender=ProductImage)
-# def generate_thumbnail(sender, instance, **kwargs):
-#     logger.info(f"Generating thumbnail for image {instance.product.id}")
-    
+@receiver(m2m_changed, sender=Product.tags.through)
+def product_tags_to_listing_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
 
-#     image = Image.open(instance.image)
-#     image = image.convert("RGB")
-#     image.thumbnail(THUMBNAIL_SIZE, Image.ANTIALIAS)
+    if reverse:
+        # tag.product_set was changed
+        catalog_cache.invalidate_tags([instance.slug])
+    elif pk_set is None:
+        catalog_cache.invalidate_tags(instance.tags.values_list("slug", flat=True))
+    else:
+        catalog_cache.invalidate_tags(
+            ProductTag.objects.filter(pk__in=pk_set).values_list("slug", flat=True)
+        )
 
-#     temp_thumb = BytesIO()
-#     image.save(temp_thumb,'JPEG')
-#     temp_thumb.seek(0) 
+@receiver(m2m_changed, sender=Product.tags.through)
+def product_tags_to_product_pages(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
 
-#     instance.thumbnail.save(instance.image.name,ContentFile(temp_thumb.read()), save=False,)
-#     temp_thumb.close()
\ No newline at end of file
+    if not reverse:
+        catalog_cache.invalidate_product_pages([instance.id])
+    elif pk_set is None:
+        catalog_cache.invalidate_product_pages(instance.product_set.values_list("id", flat=True))
+    else:
+        catalog_cache.invalidate_product_pages(pk_set)
+
+@receiver(post_save, sender=ProductTag)
+@receiver(pre_delete, sender=ProductTag)
+def tag_to_product_pages(sender, instance, signal, **kwargs):
+    # Product pages show the tag names, so only a rename or a deletion matters
+    if signal is pre_delete or (instance._previous and instance._previous["name"] != instance.name):
+        catalog_cache.invalidate_product_pages(instance.product_set.values_list("id", flat=True))
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def image_to_product_pages(sender, instance, **kwargs):
+    catalog_cache.invalidate_product_pages([instance.product_id])
+
+
+@receiver(post_save, sender=Product)
+def product_to_search_index(sender, instance, **kwargs):
+    search.get_backend().index([instance.id])
+
+@receiver(post_delete, sender=Product)
+def product_delete_to_search_index(sender, instance, **kwargs):
+    search.get_backend().remove([instance.id])
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def product_tags_to_search_index(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        search.get_backend().index([instance.id])
+    elif pk_set is not None:
+        search.get_backend().index(pk_set)
+    else:
+        search.get_backend().index(instance._cleared_product_ids)
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def tag_products_before_clear(sender, instance, action, reverse, **kwargs):
+    # The products of a tag are gone by post_clear, so remember them beforehand
+    if action == "pre_clear" and reverse:
+        instance._cleared_product_ids = list(instance.product_set.values_list("id", flat=True))
+
+@receiver(pre_delete, sender=ProductTag)
+def tag_products_before_delete(sender, instance, **kwargs):
+    instance._deleted_product_ids = list(instance.product_set.values_list("id", flat=True))
+
+@receiver(post_delete, sender=ProductTag)
+def tag_delete_to_search_index(sender, instance, **kwargs):
+    search.get_backend().index(instance._deleted_product_ids)
+
+@receiver(post_save, sender=ProductTag)
+def tag_to_search_index(sender, instance, **kwargs):
+    # Tag names are indexed with the products, so only a rename needs reindexing
+    if instance._previous and instance._previous["name"] != instance.name:
+        search.get_backend().index(instance.product_set.values_list("id", flat=True))
+
+
+@receiver(post_save, sender=Order)
+def paid_order_to_invoice(sender, instance, **kwargs):
+    """Render the invoice once the order becoming paid is committed"""
+    if not settings.INVOICE_PRERENDER_ON_PAID:
+        return
+    if instance.status == Order.PAID and instance._loaded_status != Order.PAID:
+        transaction.on_commit(lambda: invoices.prerender_invoice(instance.id))
+
+
+@receiver(pre_save, sender=OrderLine)
+def orderline_order_to_dispatch(sender, instance, **kwargs):
+    # The status of the order has to be read before the save, the rollup after it
+    # can mark the order done. Lines saved with their order at hand cost no query
+    instance.order
+
+@receiver(post_save, sender=OrderLine)
+def orderline_to_dispatch(sender, instance, **kwargs):
+    # Dispatchers only handle the lines of paid orders
+    if instance.order.status == Order.PAID:
+        dispatch.publish([
+            dispatch.orderline_event(instance.id, instance.order_id, instance.product_id, instance.status)
+        ])
+
+@receiver(order_lines_updated)
+def orderlines_updated_to_dispatch(sender, line_ids, status, **kwargs):
+    # Sent before the orders are rolled up, they are still paid
+    lines = OrderLine.objects.filter(pk__in=line_ids, order__status=Order.PAID).values_list(
+        "id", "order_id", "product_id"
+    )
+    dispatch.publish(
+        dispatch.orderline_event(line_id, order_id, product_id, status)
+        for line_id, order_id, product_id in lines
+    )
+
+@receiver(post_save, sender=Order)
+def order_to_dispatch(sender, instance, **kwargs):
+    # Dispatchers only handle orders from the moment they are paid
+    if Order.PAID in (instance.status, instance._loaded_status):
+        dispatch.publish([dispatch.order_event(instance.id, instance.status)])
+
+@receiver(orders_rolled_up)
+def rolled_up_orders_to_dispatch(sender, order_ids, **kwargs):
+    dispatch.publish(dispatch.order_event(order_id, Order.DONE) for order_id in order_ids)
+
+
+"""Every change to orders and order lines is appended to the change log read by
+    the delta-sync feed. Basket.create_order logs the lines it bulk creates"""
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_to_change_log(sender, instance, signal, **kwargs):
+    ChangeLog.objects.record(ChangeLog.ORDER, [instance.id], deleted=signal is post_delete)
+    # The feed leaves out the lines until the order is paid, they are sent with it
+    paid = instance.status == Order.PAID and instance._loaded_status != Order.PAID
+    if signal is post_save and paid and not kwargs.get("created"):
+        ChangeLog.objects.record(ChangeLog.ORDERLINE, instance.lines.values_list("id", flat=True))
+
+@receiver(post_save, sender=OrderLine)
+@receiver(post_delete, sender=OrderLine)
+def orderline_to_change_log(sender, instance, signal, **kwargs):
+    ChangeLog.objects.record(ChangeLog.ORDERLINE, [instance.id], deleted=signal is post_delete)
+
+@receiver(order_lines_updated)
+def orderlines_updated_to_change_log(sender, line_ids, **kwargs):
+    ChangeLog.objects.record(ChangeLog.ORDERLINE, line_ids)
+
+@receiver(orders_rolled_up)
+def rolled_up_orders_to_change_log(sender, order_ids, **kwargs):
+    ChangeLog.objects.record(ChangeLog.ORDER, order_ids)
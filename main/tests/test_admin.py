@@ -1,14 +1,27 @@
+from django.conf import settings
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.management import call_command
 
-from main import factories, models
+from main import factories, invoices, models
 
 from datetime import datetime
 from decimal import Decimal
+from io import StringIO
+import shutil
+import tempfile
 from unittest.mock import patch
 
 
 class TestAdminViews(TestCase):
+    def setUp(self):
+        # Invoices rendered by the tests go to a directory removed after each one
+        invoice_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, invoice_root)
+        settings_override = self.settings(INVOICE_ROOT=invoice_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
     def test_most_bought_products(self):
         products = [
             factories.ProductFactory(name="A", active=True),
@@ -103,10 +116,103 @@ class TestAdminViews(TestCase):
             {"format": "pdf"}
         )
         # self.assertEqual(response.status_code, 200)
-        content = response.content
+        content = b"".join(response.streaming_content)
 
         with open(
             "main/fixtures/invoice_test_order.pdf", "rb"
         ) as fixture:
             expected_content = fixture.read()
-        # self.assertEqual(content, expected_content)
\ No newline at end of file
+        # self.assertEqual(content, expected_content)
+
+    def test_orders_per_day_reads_rollups(self):
+        factories.OrderFactory.create_batch(3)
+        user = models.User.objects.create_superuser(
+            "user2", "pw432joij"
+        )
+        self.client.force_login(user)
+        response = self.client.get("/admin/orders_per_day/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["values"], [3])
+
+    def test_rebuild_reporting_rollups(self):
+        product = factories.ProductFactory(name="A")
+        order = factories.OrderFactory()
+        factories.OrderLineFactory.create_batch(
+            2, order=order, product=product
+        )
+        models.DailyOrderCount.objects.all().delete()
+        models.DailyProductSales.objects.update(units=0)
+
+        out = StringIO()
+        call_command("rebuild_reporting_rollups", stdout=out)
+
+        self.assertEqual(
+            list(models.DailyOrderCount.objects.values_list("count", flat=True)),
+            [1],
+        )
+        self.assertEqual(
+            list(models.DailyProductSales.objects.values_list("units", flat=True)),
+            [2],
+        )
+
+    def test_invoice_pdf_is_cached_on_storage(self):
+        order = factories.OrderFactory()
+        factories.OrderLineFactory.create_batch(
+            2, order=order, product=factories.ProductFactory()
+        )
+        user = models.User.objects.create_superuser(
+            "user2", "pw432joij"
+        )
+        self.client.force_login(user)
+        url = reverse("admin:invoice", kwargs={"order_id": order.id})
+
+        with patch(
+            "main.invoices.render_invoice", wraps=invoices.render_invoice
+        ) as mock_render:
+            response = self.client.get(url, {"format": "pdf"})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "application/pdf")
+            self.assertIn("private", response["Cache-Control"])
+            pdf = b"".join(response.streaming_content)
+
+            response = self.client.get(url, {"format": "pdf"})
+            self.assertEqual(b"".join(response.streaming_content), pdf)
+            self.assertEqual(mock_render.call_count, 1)
+
+            etag = response["ETag"]
+            response = self.client.get(
+                url, {"format": "pdf"}, HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(response.status_code, 304)
+
+            order.billing_name = "Jane Smith"
+            order.save()
+            response = self.client.get(
+                url, {"format": "pdf"}, HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(mock_render.call_count, 2)
+
+        # Only the current version is kept, out of the public MEDIA_ROOT
+        self.assertEqual(
+            invoices.invoice_storage.listdir(str(order.id))[1],
+            [invoices.invoice_path(order).split("/")[1]],
+        )
+        self.assertTrue(
+            invoices.invoice_storage.path("").startswith(
+                settings.INVOICE_ROOT
+            )
+        )
+
+    @override_settings(INVOICE_PRERENDER_ON_PAID=True)
+    def test_invoice_prerendered_when_order_paid(self):
+        order = factories.OrderFactory()
+        with patch(
+            "main.signals.transaction.on_commit", side_effect=lambda f, using=None: f()
+        ), patch("main.invoices.render_invoice", return_value=b"%PDF") as mock_render:
+            order.save()
+            self.assertEqual(mock_render.call_count, 0)
+            order.status = models.Order.PAID
+            order.save()
+            order.save()
+            self.assertEqual(mock_render.call_count, 1)
@@ -0,0 +1,76 @@
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from asgiref.sync import async_to_sync
+from booktime.handlers import ThreadPoolASGIHandler
+
+from unittest.mock import patch
+import asyncio
+import threading
+
+async def get(handler, path, root_path=""):
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": root_path + path,
+        "root_path": root_path,
+        "query_string": b"",
+        "headers": [(b"host", b"testserver")],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    await handler(scope, receive, send)
+    return messages
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class TestThreadPoolASGIHandler(SimpleTestCase):
+    def test_serves_pages(self):
+        messages = async_to_sync(get)(ThreadPoolASGIHandler(), "/about/")
+        self.assertEqual(messages[0]["status"], 200)
+        self.assertIn(b"About us", b"".join(m.get("body", b"") for m in messages[1:]))
+
+    def test_reverse_uses_root_path(self):
+        def view(request):
+            return HttpResponse(reverse("app-about"))
+
+        handler = ThreadPoolASGIHandler()
+        with patch.object(handler, "get_response", view):
+            messages = async_to_sync(get)(handler, "/about/", root_path="/shop")
+        self.assertEqual(messages[1]["body"], b"/shop/about/")
+
+    def test_connections_are_closed_in_the_request_thread(self):
+        def view(request):
+            return StreamingHttpResponse(iter([b"a", b"b"]))
+
+        threads = []
+        handler = ThreadPoolASGIHandler()
+        with patch.object(handler, "get_response", view), patch(
+            "booktime.handlers.close_old_connections", lambda: threads.append(threading.current_thread())
+        ):
+            messages = async_to_sync(get)(handler, "/a/")
+        self.assertEqual(b"".join(m.get("body", b"") for m in messages[1:]), b"ab")
+        self.assertEqual([thread.name.startswith("asgi") for thread in threads], [True])
+
+    def test_requests_run_concurrently(self):
+        # Both requests have to be in a view at the same time to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def view(request):
+            barrier.wait()
+            return HttpResponse(threading.current_thread().name)
+
+        async def both(handler):
+            return await asyncio.gather(get(handler, "/a/"), get(handler, "/b/"))
+
+        handler = ThreadPoolASGIHandler()
+        with patch.object(handler, "get_response", view):
+            results = async_to_sync(both)(handler)
+        self.assertEqual([messages[0]["status"] for messages in results], [200, 200])
+        self.assertNotEqual(results[0][1]["body"], results[1][1]["body"])
@@ -0,0 +1,80 @@
+from django.core.management import call_command
+from django.db import OperationalError, connections
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from unittest.mock import patch
+
+from main import db_router, factories, models
+
+import os
+import tempfile
+
+
+@override_settings(REPLICA_DATABASE="test_replica")
+class TestReplicaRouter(TestCase):
+    """A second SQLite file stands in for a replica that hasn't caught up with
+        anything written by the tests"""
+    databases = {"default", "test_replica"}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_file = tempfile.NamedTemporaryFile(suffix=".sqlite3", delete=False).name
+        connections.databases["test_replica"] = {"ENGINE": "django.db.backends.sqlite3", "NAME": cls.replica_file}
+        with override_settings(REPLICA_DATABASE="test_replica"):
+            call_command("migrate", database="test_replica", verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections["test_replica"].close()
+        del connections.databases["test_replica"]
+        os.remove(cls.replica_file)
+
+    def setUp(self):
+        db_router._replica_down_until = 0
+        self.user = models.User.objects.create_superuser("dispatch@a.com", "pw432joij")
+        self.order = factories.OrderFactory(user=self.user, status=models.Order.PAID)
+        self.client.force_login(self.user)
+
+    def list_orders(self):
+        return self.client.get(reverse("order-list")).json()["results"]
+
+    def test_api_reads_go_to_the_replica(self):
+        self.assertEqual(self.list_orders(), [])
+        self.assertEqual(models.Order.objects.count(), 1)
+
+    def test_client_that_wrote_reads_from_the_primary(self):
+        line = factories.OrderLineFactory(order=self.order, product=factories.ProductFactory())
+        response = self.client.patch(
+            reverse("orderline-bulk"),
+            {"lines": [{"id": line.id, "status": models.OrderLine.PROCESSING}]},
+            content_type="application/json",
+        )
+        self.assertIn("replica_pin", response.cookies)
+        self.assertEqual(len(self.list_orders()), 1)
+
+    def test_unavailable_replica_falls_back_to_the_primary(self):
+        replica = connections["test_replica"]
+        with patch.object(replica, "ensure_connection", side_effect=OperationalError):
+            self.assertEqual(len(self.list_orders()), 1)
+        # The replica isn't tried again until REPLICA_RETRY_SECONDS have passed
+        self.assertEqual(len(self.list_orders()), 1)
+
+    def test_replica_failing_a_query_falls_back_to_the_primary(self):
+        replica = connections["test_replica"]
+        with patch.object(replica, "create_cursor", side_effect=OperationalError):
+            self.assertEqual(len(self.list_orders()), 1)
+        self.assertEqual(len(self.list_orders()), 1)
+
+    def test_instances_read_from_the_replica_are_saved_to_the_primary(self):
+        product = factories.ProductFactory(name="Siddhartha")
+        product.save(using="test_replica")
+        with db_router.replica_reads():
+            replica_product = models.Product.objects.get(pk=product.pk)
+        self.assertEqual(replica_product._state.db, "test_replica")
+
+        replica_product.name = "Renamed"
+        replica_product.save()
+        self.assertEqual(models.Product.objects.get(pk=product.pk).name, "Renamed")
+        self.assertEqual(models.Product.objects.using("test_replica").get(pk=product.pk).name, "Siddhartha")
@@ -0,0 +1,71 @@
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser, Group
+from django.test import TestCase
+from unittest.mock import patch
+
+from main import factories, models
+from main.consumers import DispatchConsumer
+
+
+def run_on_commit(func, using=None):
+    func()
+
+@patch("main.dispatch.transaction.on_commit", run_on_commit)
+class TestDispatchFeed(TestCase):
+    def setUp(self):
+        self.dispatcher = models.User.objects.create_user("dispatch@a.com", "pw432joij", is_staff=True)
+        self.dispatcher.groups.add(Group.objects.create(name="Dispatchers"))
+
+    def connect(self, user):
+        communicator = WebsocketCommunicator(DispatchConsumer.as_asgi(), "/ws/dispatch/")
+        communicator.scope["user"] = user
+        return communicator
+
+    def test_anonymous_users_are_refused(self):
+        async def run():
+            communicator = self.connect(AnonymousUser())
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+
+        async_to_sync(run)()
+
+    def test_dispatchers_receive_line_and_order_changes(self):
+        order = factories.OrderFactory(status=models.Order.PAID)
+        line = factories.OrderLineFactory(order=order, product=factories.ProductFactory())
+
+        def mark_sent():
+            models.OrderLine.objects.filter(pk=line.pk).set_status(models.OrderLine.SENT)
+
+        async def run():
+            communicator = self.connect(self.dispatcher)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            await database_sync_to_async(mark_sent)()
+            lines = await communicator.receive_json_from()
+            orders = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return lines, orders
+
+        lines, orders = async_to_sync(run)()
+        self.assertEqual(lines["events"], [{
+            "type": "orderline", "id": line.id, "order": order.id,
+            "product": line.product_id, "status": models.OrderLine.SENT,
+        }])
+        self.assertEqual(orders["events"], [
+            {"type": "order", "id": order.id, "status": models.Order.DONE}
+        ])
+
+    def test_lines_of_unpaid_orders_are_not_published(self):
+        line = factories.OrderLineFactory(
+            order=factories.OrderFactory(status=models.Order.NEW),
+            product=factories.ProductFactory(),
+        )
+        with patch("main.dispatch._send") as send:
+            line.status = models.OrderLine.PROCESSING
+            line.save()
+            models.OrderLine.objects.filter(pk=line.pk).set_status(models.OrderLine.SENT)
+        events = [event for call in send.call_args_list for event in call[0][0]]
+        self.assertEqual([event for event in events if event["type"] == "orderline"], [])
@@ -0,0 +1,211 @@
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from io import StringIO
+from unittest.mock import patch
+
+from main import factories, models
+
+
+class TestDispatchEndpoints(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_superuser("dispatch@a.com", "pw432joij")
+        self.client.force_login(self.user)
+
+    def create_paid_orders(self, count):
+        for _ in range(count):
+            order = factories.OrderFactory(status=models.Order.PAID)
+            factories.OrderLineFactory.create_batch(2, order=order, product=factories.ProductFactory())
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_list_queries_do_not_grow_with_the_page(self):
+        for name in ("orderline-list", "order-list"):
+            models.Order.objects.all().delete()
+            self.create_paid_orders(2)
+            few = self.count_queries(reverse(name))
+            self.create_paid_orders(8)
+            self.assertEqual(self.count_queries(reverse(name)), few)
+
+    def test_cursor_pagination_walks_every_line(self):
+        self.create_paid_orders(3)
+        factories.OrderLineFactory(
+            order=factories.OrderFactory(status=models.Order.NEW), product=factories.ProductFactory()
+        )
+
+        seen = []
+        url = reverse("orderline-list") + "?page_size=4"
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(line["id"] for line in data["results"])
+            url = data["next"]
+
+        paid = models.OrderLine.objects.filter(order__status=models.Order.PAID).order_by("-id")
+        self.assertEqual(seen, list(paid.values_list("id", flat=True)))
+
+    def test_unchanged_page_is_not_modified(self):
+        self.create_paid_orders(2)
+        url = reverse("orderline-list")
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        with self.assertNumQueries(3): # session, user and the page versions
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        line = models.OrderLine.objects.first()
+        line.status = models.OrderLine.PROCESSING
+        line.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_bulk_status_update(self):
+        self.create_paid_orders(2)
+        first, second = models.Order.objects.order_by("id")
+        lines = list(first.lines.all()) + [second.lines.first()]
+        payload = {"lines": [{"id": line.id, "status": models.OrderLine.SENT} for line in lines]}
+        payload["lines"].append({"id": 9999, "status": models.OrderLine.SENT})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                reverse("orderline-bulk"), payload, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([r["updated"] for r in results], [True, True, True, False])
+
+        self.create_paid_orders(3)
+        third = models.Order.objects.order_by("id").last()
+        payload = {"lines": [{"id": line.id, "status": models.OrderLine.SENT} for line in third.lines.all()]}
+        with CaptureQueriesContext(connection) as more_queries:
+            self.client.patch(reverse("orderline-bulk"), payload, content_type="application/json")
+        self.assertEqual(len(more_queries), len(queries))
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.status, models.Order.DONE)
+        self.assertEqual(second.status, models.Order.PAID)
+
+    def test_bulk_status_update_validates_every_line(self):
+        line = factories.OrderLineFactory(
+            order=factories.OrderFactory(status=models.Order.PAID), product=factories.ProductFactory()
+        )
+        response = self.client.patch(
+            reverse("orderline-bulk"),
+            {"lines": [{"id": line.id, "status": models.OrderLine.SENT}, {"id": line.id, "status": 99}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        line.refresh_from_db()
+        self.assertEqual(line.status, models.OrderLine.NEW)
+
+
+def run_on_commit(func, using=None):
+    func()
+
+@override_settings(CHANGE_FEED_POLL_INTERVAL=0.01)
+@patch("main.models.transaction.on_commit", run_on_commit)
+class TestChangeFeed(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_superuser("dispatch@a.com", "pw432joij")
+        self.client.force_login(self.user)
+
+    def changes(self, since=0, **params):
+        return self.client.get(reverse("changelog-list"), {"since": since, **params}).json()
+
+    def test_feed_returns_each_change_once_after_the_cursor(self):
+        order = factories.OrderFactory(status=models.Order.PAID)
+        lines = factories.OrderLineFactory.create_batch(2, order=order, product=factories.ProductFactory())
+        feed = self.changes()
+        self.assertEqual(
+            [(c["resource"], c["id"]) for c in feed["changes"]],
+            [("order", order.id), ("orderline", lines[0].id), ("orderline", lines[1].id)],
+        )
+
+        models.OrderLine.objects.filter(order=order).set_status(models.OrderLine.SENT)
+        deleted_id = lines[0].id
+        lines[0].delete()
+        feed = self.changes(feed["cursor"])
+        self.assertEqual(
+            [(c["resource"], c["id"], c["deleted"]) for c in feed["changes"]],
+            [("orderline", lines[1].id, False), ("order", order.id, False), ("orderline", deleted_id, True)],
+        )
+        self.assertEqual(feed["changes"][1]["data"]["status"], models.Order.DONE)
+        self.assertIsNone(feed["changes"][2]["data"])
+
+        self.assertEqual(self.changes(feed["cursor"])["changes"], [])
+
+    def test_pruned_log_keeps_the_last_change_of_each_record(self):
+        order = factories.OrderFactory(status=models.Order.PAID)
+        lines = factories.OrderLineFactory.create_batch(2, order=order, product=factories.ProductFactory())
+        cursor = self.changes()["cursor"]
+        models.OrderLine.objects.filter(order=order).set_status(models.OrderLine.SENT)
+        lines[0].delete()
+        expected = self.changes(cursor)["changes"]
+
+        call_command("prune_change_log", stdout=StringIO())
+        self.assertEqual(self.changes(cursor)["changes"], expected)
+        self.assertEqual(models.ChangeLog.objects.count(), 3)
+
+    def test_entries_committed_late_come_after_the_cursor(self):
+        order = factories.OrderFactory(status=models.Order.PAID)
+        cursor = self.changes()["cursor"]
+        # An entry with a lower id than the ones already numbered, as a
+        # transaction that was still running would leave
+        first_id = models.ChangeLog.objects.order_by("id").values_list("id", flat=True)[0]
+        models.ChangeLog.objects.bulk_create([
+            models.ChangeLog(id=first_id - 1, resource=models.ChangeLog.ORDER, object_id=order.id)
+        ])
+        models.ChangeLog.objects.sequence()
+
+        feed = self.changes(cursor)
+        self.assertEqual([(c["resource"], c["id"]) for c in feed["changes"]], [("order", order.id)])
+        self.assertGreater(feed["cursor"], cursor)
+
+    def test_feed_pages_with_limit(self):
+        factories.OrderFactory.create_batch(3, status=models.Order.PAID)
+        feed = self.changes(limit=2)
+        self.assertEqual(len(feed["changes"]), 2)
+        self.assertTrue(feed["more"])
+        feed = self.changes(feed["cursor"], limit=2)
+        self.assertEqual(len(feed["changes"]), 1)
+        self.assertFalse(feed["more"])
+
+    def test_feed_waits_for_changes(self):
+        cursor = self.changes()["cursor"]
+        with patch("main.endpoints.time.sleep") as sleep:
+            feed = self.changes(cursor, wait=1)
+        self.assertEqual(feed["changes"], [])
+        self.assertTrue(sleep.called)
+
+    def test_feed_skips_orders_before_they_are_paid(self):
+        order = factories.OrderFactory(status=models.Order.NEW)
+        line = factories.OrderLineFactory(order=order, product=factories.ProductFactory())
+        feed = self.changes()
+        self.assertEqual(feed["changes"], [])
+
+        order.status = models.Order.PAID
+        order.save()
+        feed = self.changes(feed["cursor"])
+        self.assertEqual(
+            [(c["resource"], c["id"]) for c in feed["changes"]],
+            [("order", order.id), ("orderline", line.id)],
+        )
+
+    def test_feed_is_for_dispatchers_only(self):
+        customer = models.User.objects.create_user("user@a.com", "pw432joij")
+        self.client.force_login(customer)
+        response = self.client.get(reverse("changelog-list"))
+        self.assertEqual(response.status_code, 403)
+
+    def test_feed_rejects_bad_cursor(self):
+        response = self.client.get(reverse("changelog-list"), {"since": "x"})
+        self.assertEqual(response.status_code, 400)
@@ -2,6 +2,7 @@ from django.test import TestCase
 from django.core import mail
 
 from main import forms as user_forms
+from main import outbox
 
 class TestForm(TestCase):
     def test_valid_contact_form_sends_email(self):
@@ -14,6 +15,8 @@ class TestForm(TestCase):
         with self.assertLogs('main.forms', level='INFO') as cm:
             test_form.send_mail()
 
+        self.assertEqual(len(mail.outbox), 0)
+        outbox.send_batch()
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, "Site message")
 
@@ -37,6 +40,7 @@ class TestForm(TestCase):
         self.assertTrue(form.is_valid())
         with self.assertLogs("main.forms", level="INFO") as cm:
             form.send_mail()
+        outbox.send_batch()
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(
             mail.outbox[0].subject, "Welcome to Booktime"
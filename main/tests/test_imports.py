@@ -1,4 +1,6 @@
 from io import StringIO
+import os
+import shutil
 import tempfile
 from django.conf import settings
 from django.core.management import call_command
@@ -20,4 +22,83 @@ class TestImport(TestCase):
         # self.assertEqual(out.getvalue(), expected_out)
         self.assertEqual(models.Product.objects.count(), 3)
         self.assertEqual(models.ProductTag.objects.count(), 6)
-        self.assertEqual(models.ProductImage.objects.count(), 3)
\ No newline at end of file
+        self.assertEqual(models.ProductImage.objects.count(), 3)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_import_data_bulk(self):
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, "products.csv")
+            shutil.copy('main/fixtures/sample_products.csv', csv_path)
+            args = [csv_path, 'main/fixtures/sample_images/',
+                    '--bulk', '--chunk-size=2', '--processes=1']
+            call_command('import_data', *args, stdout=out)
+
+        self.assertFalse(models.ImportCheckpoint.objects.exists())
+
+        self.assertIn("Products processed = 3 (created=3)", out.getvalue())
+        self.assertIn("Tags processed = 6 (created=6)", out.getvalue())
+        self.assertIn("Rows committed = 3", out.getvalue())
+        self.assertEqual(models.Product.objects.count(), 3)
+        self.assertEqual(models.ProductTag.objects.count(), 6)
+        self.assertEqual(models.Product.tags.through.objects.count(), 6)
+        self.assertEqual(
+            models.ProductImage.objects.filter(
+                thumbnail_status=models.ProductImage.READY
+            ).count(),
+            3,
+        )
+        self.assertEqual(
+            models.ProductImageRendition.objects.count(),
+            3 * len(settings.THUMBNAIL_RENDITIONS),
+        )
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_import_data_bulk_resumes_after_committed_rows(self):
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, "products.csv")
+            shutil.copy('main/fixtures/sample_products.csv', csv_path)
+            models.ImportCheckpoint.objects.create(source=csv_path, rows=2)
+            args = [csv_path, 'main/fixtures/sample_images/',
+                    '--bulk', '--resume', '--processes=1']
+            call_command('import_data', *args, stdout=out)
+
+        self.assertIn("Resuming after row 2", out.getvalue())
+        self.assertEqual(
+            list(models.Product.objects.values_list("name", flat=True)),
+            ["Backgammon for dummies"],
+        )
+        self.assertFalse(models.ImportCheckpoint.objects.exists())
+
+    def test_import_data_bulk_empty_file(self):
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, "products.csv")
+            with open(csv_path, "w") as f:
+                f.write("name,description,tags,image_filename,price\n")
+            args = [csv_path, 'main/fixtures/sample_images/',
+                    '--bulk', '--processes=1']
+            call_command('import_data', *args, stdout=out)
+
+        self.assertEqual(models.Product.objects.count(), 0)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_import_data_bulk_numbers_shared_slugs(self):
+        models.Product.objects.create(
+            name="Backgammon for dummies", slug="backgammon-for-dummies", price="1.00"
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, "products.csv")
+            shutil.copy('main/fixtures/sample_products.csv', csv_path)
+            args = [csv_path, 'main/fixtures/sample_images/',
+                    '--bulk', '--processes=1']
+            call_command('import_data', *args, stdout=StringIO())
+
+        self.assertEqual(
+            list(
+                models.Product.objects.filter(name="Backgammon for dummies")
+                .order_by("id").values_list("slug", flat=True)
+            ),
+            ["backgammon-for-dummies", "backgammon-for-dummies-2"],
+        )
@@ -0,0 +1,61 @@
+from django.contrib.admin.sites import AdminSite
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from unittest import skipUnless
+
+from main import admin, factories, models
+
+
+@skipUnless(connection.vendor == "sqlite", "The plans are read in the SQLite EXPLAIN QUERY PLAN format")
+class TestHotQueryIndexes(TestCase):
+    def assertUsesIndex(self, queryset, index):
+        """Every table access of the plan has to go through an index, index
+            among them, and the rows must not need sorting"""
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        for line in plan.splitlines():
+            if " SCAN " in f" {line} " or " SEARCH " in f" {line} ":
+                self.assertRegex(line, "INDEX|PRIMARY KEY", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_product_listing(self):
+        self.assertUsesIndex(
+            models.Product.objects.active().order_by("name"), "product_active_name_idx"
+        )
+
+    def test_product_detail(self):
+        self.assertUsesIndex(models.Product.objects.filter(slug="x"), "sqlite_autoindex_main_product")
+
+    def test_tag_lookup(self):
+        self.assertUsesIndex(models.ProductTag.objects.filter(slug="x"), "sqlite_autoindex_main_producttag")
+
+    def test_open_basket_of_user(self):
+        user = factories.UserFactory()
+        self.assertUsesIndex(
+            models.Basket.objects.filter(user=user, status=models.Basket.OPEN), "basket_user_status_idx"
+        )
+
+    def test_paid_orders(self):
+        self.assertUsesIndex(
+            models.Order.objects.filter(status=models.Order.PAID).order_by("-date_added"),
+            "order_status_added_idx",
+        )
+        self.assertUsesIndex(
+            models.Order.objects.filter(status=models.Order.PAID, id__lt=100).order_by("-id"),
+            "order_status_id_idx",
+        )
+
+    def test_dispatchers_order_admin(self):
+        request = RequestFactory().get("/")
+        request.user = factories.UserFactory(is_superuser=True)
+        order_admin = admin.DispatchersOrderAdmin(models.Order, AdminSite())
+        self.assertUsesIndex(
+            order_admin.get_queryset(request).order_by("-pk"), "order_status_id_idx"
+        )
+
+    def test_order_lines_rollup(self):
+        order = factories.OrderFactory()
+        self.assertUsesIndex(
+            models.OrderLine.objects.filter(order=order, status__lt=models.OrderLine.SENT),
+            "orderline_order_status_idx",
+        )
@@ -1,7 +1,18 @@
+from datetime import timedelta
 from decimal import Decimal
-from django.test import TestCase
+from io import StringIO
+import tempfile
+from django.conf import settings
+from django.core.files.images import ImageFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, IntegrityError, transaction
+from django.utils import timezone
+from unittest.mock import patch
 from main import models
 from main import factories
+from main import thumbnails
 
 
 class TestModel(TestCase):
@@ -38,4 +49,271 @@ class TestModel(TestCase):
         self.assertEquals(order.lines.all().count(), 2)
         lines = order.lines.all()
         self.assertEquals(lines[0].product, p1)
-        self.assertEquals(lines[1].product, p2)
\ No newline at end of file
+        self.assertEquals(lines[1].product, p2)
+        self.assertEqual(
+            dict(models.DailyProductSales.objects.values_list("product", "units")),
+            {p1.id: 1, p2.id: 1},
+        )
+        self.assertEqual(models.DailyOrderCount.objects.get().count, 1)
+
+    def test_create_order_query_count_is_constant(self):
+        user1 = factories.UserFactory()
+        billing = factories.AddressFactory(user=user1)
+        shipping = factories.AddressFactory(user=user1)
+
+        def count_queries(quantity):
+            basket = models.Basket.objects.create(user=user1)
+            models.BasketLine.objects.create(
+                basket=basket, product=factories.ProductFactory(), quantity=quantity
+            )
+            models.BasketLine.objects.create(
+                basket=basket, product=factories.ProductFactory(), quantity=quantity
+            )
+            with CaptureQueriesContext(connection) as ctx:
+                order = basket.create_order(billing, shipping)
+            self.assertEqual(order.lines.count(), quantity * 2)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(1), count_queries(20))
+
+    def test_create_order_is_atomic(self):
+        user1 = factories.UserFactory()
+        billing = factories.AddressFactory(user=user1)
+        basket = models.Basket.objects.create(user=user1)
+        models.BasketLine.objects.create(
+            basket=basket, product=factories.ProductFactory()
+        )
+        with patch.object(
+            models.OrderLine.objects, "bulk_create", side_effect=IntegrityError
+        ):
+            with self.assertRaises(IntegrityError):
+                basket.create_order(billing, billing)
+
+        self.assertFalse(models.Order.objects.exists())
+        basket.refresh_from_db()
+        self.assertEqual(basket.status, models.Basket.OPEN)
+
+    def test_order_marked_done_when_all_lines_sent(self):
+        order = factories.OrderFactory(status=models.Order.PAID)
+        p1 = factories.ProductFactory()
+        lines = factories.OrderLineFactory.create_batch(
+            2, order=order, product=p1
+        )
+        lines[0].status = models.OrderLine.SENT
+        lines[0].save()
+        order.refresh_from_db()
+        self.assertEqual(order.status, models.Order.PAID)
+
+        lines[1].status = models.OrderLine.CANCELLED
+        lines[1].save()
+        order.refresh_from_db()
+        self.assertEqual(order.status, models.Order.DONE)
+
+    def test_rollup_status_is_set_based(self):
+        p1 = factories.ProductFactory()
+        done = factories.OrderFactory.create_batch(3, status=models.Order.PAID)
+        pending = factories.OrderFactory(status=models.Order.PAID)
+        empty = factories.OrderFactory(status=models.Order.PAID)
+        for order in done + [pending]:
+            factories.OrderLineFactory(order=order, product=p1)
+        models.OrderLine.objects.filter(order__in=done).update(
+            status=models.OrderLine.SENT
+        )
+
+        # A single UPDATE without orders_rolled_up receivers
+        with patch.object(models.orders_rolled_up, "has_listeners", return_value=False):
+            with transaction.atomic():
+                with self.assertNumQueries(1):
+                    models.Order.objects.all().rollup_status()
+                transaction.set_rollback(True)
+
+        # The ids are read first for the receivers, the change log records them
+        # with one INSERT
+        with self.assertNumQueries(3):
+            changed = models.Order.objects.all().rollup_status()
+
+        self.assertEqual(changed, 3)
+        self.assertEqual(
+            set(models.Order.objects.filter(status=models.Order.DONE)),
+            set(done),
+        )
+        pending.refresh_from_db()
+        empty.refresh_from_db()
+        self.assertEqual(pending.status, models.Order.PAID)
+        self.assertEqual(empty.status, models.Order.PAID)
+
+    def test_deferred_rollup_runs_once_per_block(self):
+        p1 = factories.ProductFactory()
+        order = factories.OrderFactory(status=models.Order.PAID)
+        lines = factories.OrderLineFactory.create_batch(
+            5, order=order, product=p1
+        )
+        # line saves and their change log entries, order reload, then the rollup
+        # reading the ids, updating and logging the order
+        with self.assertNumQueries(len(lines) * 2 + 4):
+            with models.deferred_order_rollup():
+                for line in lines:
+                    line.status = models.OrderLine.SENT
+                    line.save()
+                order.refresh_from_db()
+                self.assertEqual(order.status, models.Order.PAID)
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, models.Order.DONE)
+
+    def test_orderline_set_status_rolls_up_orders(self):
+        p1 = factories.ProductFactory()
+        orders = factories.OrderFactory.create_batch(2, status=models.Order.PAID)
+        for order in orders:
+            factories.OrderLineFactory.create_batch(3, order=order, product=p1)
+
+        updated = models.OrderLine.objects.filter(
+            order=orders[0]
+        ).set_status(models.OrderLine.SENT)
+
+        self.assertEqual(updated, 3)
+        orders[0].refresh_from_db()
+        orders[1].refresh_from_db()
+        self.assertEqual(orders[0].status, models.Order.DONE)
+        self.assertEqual(orders[1].status, models.Order.PAID)
+
+    def test_basket_totals_follow_lines(self):
+        p1 = factories.ProductFactory(price=Decimal("10.00"))
+        p2 = factories.ProductFactory(price=Decimal("2.50"))
+        basket = models.Basket.objects.create()
+        self.assertTrue(basket.is_empty())
+
+        line = models.BasketLine.objects.create(
+            basket=basket, product=p1, quantity=2
+        )
+        models.BasketLine.objects.create(basket=basket, product=p2)
+        basket.refresh_totals()
+        self.assertEqual(basket.count(), 3)
+        self.assertEqual(basket.subtotal, Decimal("22.50"))
+
+        line.delete()
+        p2.price = Decimal("3.00")
+        p2.save()
+        basket.refresh_totals()
+        self.assertEqual(basket.count(), 1)
+        self.assertEqual(basket.subtotal, Decimal("3.00"))
+
+        with self.assertNumQueries(0):
+            self.assertFalse(basket.is_empty())
+            self.assertEqual(basket.count(), 1)
+
+    def test_basket_add_product_increments_in_database(self):
+        product = factories.ProductFactory(price=Decimal("4.00"))
+        basket = models.Basket.objects.create()
+        self.assertEqual(basket.add_product(product), 1)
+
+        # A stale copy of the basket doesn't hold the quantities back
+        self.assertEqual(models.Basket(pk=basket.pk).add_product(product, 2), 3)
+        self.assertEqual(basket.add_product(product), 4)
+        self.assertEqual(basket.count(), 4)
+        self.assertEqual(basket.subtotal, Decimal("16.00"))
+
+        with self.assertRaises(IntegrityError):
+            models.BasketLine.objects.create(basket=basket, product=product)
+
+    def test_basket_set_quantities_is_set_based(self):
+        products = [factories.ProductFactory(price=Decimal("1.00")) for _ in range(6)]
+        basket = models.Basket.objects.create()
+        models.BasketLine.objects.bulk_create(
+            models.BasketLine(basket=basket, product=product) for product in products
+        )
+
+        with self.assertNumQueries(8):
+            found = basket.set_quantities({
+                products[0].id: 5, products[1].id: 0, products[2].id: 2, products[3].id: 0, 9999: 1,
+            })
+        self.assertEqual(found, {p.id for p in products[:4]})
+        self.assertEqual(
+            dict(basket.basketline_set.values_list("product", "quantity")),
+            {products[0].id: 5, products[2].id: 2, products[4].id: 1, products[5].id: 1},
+        )
+        self.assertEqual(basket.count(), 9)
+
+    def test_basket_merge_is_set_based(self):
+        user1 = models.User.objects.create_user("user1@a.com", "pw432joij")
+        products = [factories.ProductFactory(price=Decimal("1.00")) for _ in range(6)]
+
+        def make_basket(user, lines):
+            basket = models.Basket.objects.create(user=user)
+            models.BasketLine.objects.bulk_create(
+                models.BasketLine(basket=basket, product=product, quantity=quantity)
+                for product, quantity in lines
+            )
+            return basket
+
+        for size in (2, 4):
+            models.Basket.objects.all().delete()
+            basket = make_basket(user1, [(p, 1) for p in products[:size]])
+            other = make_basket(None, [(p, 2) for p in products[size // 2:size + 2]])
+            with self.assertNumQueries(11):
+                basket.merge(other)
+
+        self.assertFalse(models.Basket.objects.filter(pk=other.pk).exists())
+        self.assertEqual(
+            dict(basket.basketline_set.values_list("product", "quantity")),
+            {products[0].id: 1, products[1].id: 1, products[2].id: 3,
+             products[3].id: 3, products[4].id: 2, products[5].id: 2},
+        )
+        self.assertEqual(basket.count(), 12)
+        self.assertEqual(basket.subtotal, Decimal("12.00"))
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_product_image_renditions_are_generated_by_worker(self):
+        product = factories.ProductFactory()
+        with open("main/fixtures/cb/cb1.jpg", "rb") as f:
+            image = models.ProductImage(
+                product=product, image=ImageFile(f, name="cb1.jpg")
+            )
+            image.save()
+
+        self.assertEqual(image.thumbnail_status, models.ProductImage.PENDING)
+        self.assertFalse(image.thumbnail)
+        self.assertEqual(image.thumbnail_url, image.image.url)
+
+        out = StringIO()
+        call_command("process_thumbnails", "--once", "--concurrency=1", stdout=out)
+        self.assertIn("Images processed = 1", out.getvalue())
+
+        image.refresh_from_db()
+        self.assertEqual(image.thumbnail_status, models.ProductImage.READY)
+        self.assertEqual(
+            set(image.renditions.values_list("name", flat=True)),
+            set(settings.THUMBNAIL_RENDITIONS),
+        )
+        small = image.renditions.get(name="small")
+        self.assertLessEqual(max(small.width, small.height), 150)
+        self.assertTrue(image.rendition_url("medium_webp").endswith(".webp"))
+        self.assertEqual(image.thumbnail_url, image.renditions.get(name="medium").file.url)
+
+    def test_claim_batch_moves_pending_images_to_processing(self):
+        product = factories.ProductFactory()
+        images = [
+            models.ProductImage.objects.create(
+                product=product, image="product-images/cb1.jpg", thumbnail_status=status
+            )
+            for status in (models.ProductImage.PENDING, models.ProductImage.READY,
+                           models.ProductImage.PENDING, models.ProductImage.PENDING)
+        ]
+        self.assertEqual(thumbnails.claim_batch(2), [images[0].id, images[2].id])
+        self.assertEqual(thumbnails.claim_batch(), [images[3].id])
+        self.assertEqual(thumbnails.claim_batch(), [])
+        self.assertEqual(
+            models.ProductImage.objects.filter(thumbnail_status=models.ProductImage.PROCESSING).count(), 3
+        )
+
+    def test_claim_batch_reclaims_expired_claims(self):
+        product = factories.ProductFactory()
+        image = models.ProductImage.objects.create(product=product, image="product-images/cb1.jpg")
+        self.assertEqual(thumbnails.claim_batch(), [image.id])
+        self.assertEqual(thumbnails.claim_batch(), [])
+        self.assertFalse(thumbnails.claim(image.id))
+
+        models.ProductImage.objects.filter(pk=image.id).update(
+            thumbnail_claimed=timezone.now() - timedelta(seconds=settings.THUMBNAIL_CLAIM_LEASE + 1)
+        )
+        self.assertEqual(thumbnails.claim_batch(), [image.id])
@@ -0,0 +1,92 @@
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from main import models, outbox
+
+from datetime import timedelta
+import smtplib
+
+class CountingBackend(locmem.EmailBackend):
+    """Counts the connections opened, refuses the recipients at bounce.example"""
+    opened = 0
+    is_open = False
+
+    def open(self):
+        if self.is_open:
+            return False
+        self.is_open = True
+        CountingBackend.opened += 1
+        return True
+
+    def close(self):
+        self.is_open = False
+
+    def send_messages(self, messages):
+        for message in messages:
+            if any(r.endswith("@bounce.example") for r in message.recipients()):
+                raise smtplib.SMTPRecipientsRefused({r: (550, b"No such user") for r in message.recipients()})
+        return super().send_messages(messages)
+
+class UnreachableBackend(locmem.EmailBackend):
+    def open(self):
+        raise ConnectionRefusedError("Connection refused")
+
+@override_settings(
+    EMAIL_BACKEND="main.tests.test_outbox.CountingBackend",
+    EMAIL_OUTBOX_RETRY_DELAY=60,
+    EMAIL_OUTBOX_MAX_ATTEMPTS=2,
+)
+class TestOutbox(TestCase):
+    def setUp(self):
+        CountingBackend.opened = 0
+
+    def test_batch_is_sent_over_one_connection(self):
+        for i in range(3):
+            outbox.send_mail("Hello", "Body", "site@booktime.com", [f"user{i}@a.com", "copy@a.com"])
+        self.assertEqual(len(mail.outbox), 0)
+
+        result = outbox.send_batch()
+        self.assertEqual((result.sent, result.retried, result.failed), (3, 0, 0))
+        self.assertEqual(CountingBackend.opened, 1)
+        self.assertEqual(mail.outbox[0].to, ["user0@a.com", "copy@a.com"])
+        self.assertEqual(
+            models.OutgoingEmail.objects.filter(status=models.OutgoingEmail.SENT).count(), 3
+        )
+        self.assertEqual(outbox.send_batch().sent, 0)
+
+    def test_failed_email_is_retried_with_backoff(self):
+        outbox.send_mail("Hello", "Body", "site@booktime.com", ["nobody@bounce.example"])
+        outbox.send_mail("Hello", "Body", "site@booktime.com", ["user@a.com"])
+
+        with self.assertLogs("main.outbox", level="WARNING"):
+            result = outbox.send_batch()
+        self.assertEqual((result.sent, result.retried, result.failed), (1, 1, 0))
+        email = models.OutgoingEmail.objects.get(recipients="nobody@bounce.example")
+        self.assertEqual(email.status, models.OutgoingEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn("SMTPRecipientsRefused", email.last_error)
+        self.assertGreater(email.next_attempt, timezone.now() + timedelta(seconds=50))
+
+        # Not due yet
+        self.assertEqual(outbox.send_batch()[:3], (0, 0, 0))
+        models.OutgoingEmail.objects.filter(pk=email.pk).update(next_attempt=timezone.now())
+        with self.assertLogs("main.outbox", level="ERROR"):
+            result = outbox.send_batch()
+        self.assertEqual(result.failed, 1)
+        email.refresh_from_db()
+        self.assertEqual(email.status, models.OutgoingEmail.FAILED)
+
+    @override_settings(EMAIL_BACKEND="main.tests.test_outbox.UnreachableBackend")
+    def test_unreachable_server_postpones_batch(self):
+        outbox.send_mail("Hello", "Body", "site@booktime.com", ["user@a.com"])
+        outbox.send_mail("Hello", "Body", "site@booktime.com", ["user2@a.com"])
+
+        with self.assertLogs("main.outbox", level="WARNING"):
+            result = outbox.send_batch()
+        self.assertEqual(result.retried, 2)
+        for email in models.OutgoingEmail.objects.all():
+            self.assertEqual(email.status, models.OutgoingEmail.PENDING)
+            self.assertEqual(email.attempts, 0)
+            self.assertGreater(email.next_attempt, timezone.now())
@@ -0,0 +1,81 @@
+from decimal import Decimal
+from unittest import skipUnless
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from main import models, search
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        self.cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            description="A book about open source methodologies",
+            price=Decimal("10.00"),
+        )
+        self.siddhartha = models.Product.objects.create(
+            name="Siddhartha",
+            slug="siddhartha",
+            description="A novel about a journey of self-discovery",
+            price=Decimal("6.00"),
+        )
+        self.backgammon = models.Product.objects.create(
+            name="Backgammon for dummies",
+            slug="backgammon-for-dummies",
+            description="How to start playing Backgammon",
+            price=Decimal("13.00"),
+        )
+
+    def test_search_ranks_name_matches_first(self):
+        self.cb.tags.create(name="Backgammon", slug="backgammon")
+        result = search.get_backend().search("backgammon")
+        self.assertEqual(result.total, 2)
+        self.assertEqual(result.ids, [self.backgammon.id, self.cb.id])
+
+    def test_index_follows_catalog_changes(self):
+        backend = search.get_backend()
+        self.assertEqual(backend.search("novel").ids, [self.siddhartha.id])
+
+        self.siddhartha.description = "Hermann Hesse"
+        self.siddhartha.save()
+        self.assertEqual(backend.search("novel").total, 0)
+
+        tag = models.ProductTag.objects.create(name="Classics", slug="classics")
+        tag.product_set.add(self.siddhartha)
+        self.assertEqual(backend.search("classic").ids, [self.siddhartha.id])
+
+        tag.name = "Fiction"
+        tag.save()
+        self.assertEqual(backend.search("classic").total, 0)
+        self.assertEqual(backend.search("fiction").ids, [self.siddhartha.id])
+
+        tag.delete()
+        self.assertEqual(backend.search("fiction").total, 0)
+
+        self.siddhartha.delete()
+        self.assertEqual(backend.search("hesse").total, 0)
+
+    def test_search_excludes_inactive_and_ignores_syntax(self):
+        models.Product.objects.filter(pk=self.cb.pk).update(active=False)
+        result = search.get_backend().search('open "source" OR*')
+        self.assertEqual(result.total, 0)
+
+    @skipUnless(connection.vendor == "sqlite", "Counts FTS5 prefix matches")
+    def test_search_page_is_paginated(self):
+        response = self.client.get(reverse("search"), {"q": "a"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "main/product_search.html")
+        self.assertEqual(response.context["paginator"].count, 2)
+
+        response = self.client.get(
+            reverse("search"), {"q": "siddhartha", "format": "json"}
+        )
+        self.assertEqual(response.json()["count"], 1)
+        self.assertEqual(
+            response.json()["results"][0]["slug"], "siddhartha"
+        )
+
+        response = self.client.get(reverse("search"), {"q": "a", "page": 5})
+        self.assertEqual(response.status_code, 404)
@@ -1,14 +1,22 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.files.images import ImageFile
 from django.urls import reverse
 from django.contrib import auth
+from django.db import connection
+from django.core.cache import cache
+from django.test.utils import CaptureQueriesContext
 
 from main import forms as user_forms
 from main import models
 
 from unittest.mock import patch
 from decimal import Decimal
+import tempfile
 
 class TestPage(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_home_page_route(self):
         response = self.client.get(reverse('app-home'))
         self.assertEqual(response.status_code, 200)
@@ -210,6 +218,43 @@ class TestPage(TestCase):
             2,
         )
     
+    def test_basket_formset_updates_the_totals_once(self):
+        user1 = models.User.objects.create_user("user1@a.com", "pw432joij")
+        cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        w = models.Product.objects.create(
+            name="Microsoft Windows guide",
+            slug="microsoft-windows-guide",
+            price=Decimal("12.00"),
+        )
+        self.client.force_login(user1)
+        self.client.get(reverse("add_to_basket"), {"product_id": cb.id})
+        self.client.get(reverse("add_to_basket"), {"product_id": w.id})
+        basket = models.Basket.objects.get(user=user1)
+        cb_line, w_line = basket.basketline_set.order_by("pk")
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse("basket"), {
+                "basketline_set-TOTAL_FORMS": 2,
+                "basketline_set-INITIAL_FORMS": 2,
+                "basketline_set-MIN_NUM_FORMS": 0,
+                "basketline_set-MAX_NUM_FORMS": 1000,
+                "basketline_set-0-id": cb_line.id,
+                "basketline_set-0-quantity": 3,
+                "basketline_set-1-id": w_line.id,
+                "basketline_set-1-quantity": 1,
+                "basketline_set-1-DELETE": "on",
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len([q for q in ctx.captured_queries if q["sql"].startswith('UPDATE "main_basket"')]), 1
+        )
+        basket.refresh_from_db()
+        self.assertEqual((basket.item_count, basket.subtotal), (3, Decimal("30.00")))
+
     def test_add_to_basket_login_merge_works(self):
         user1 = models.User.objects.create_user(
             "user1@a.com", "pw432joij"
@@ -242,4 +287,398 @@ class TestPage(TestCase):
             models.Basket.objects.filter(user=user1).exists()
         )
         basket = models.Basket.objects.get(user=user1)
-        self.assertEquals(basket.count(),3)
\ No newline at end of file
+        self.assertEquals(basket.count(),3)
+
+    @override_settings(ANONYMOUS_BASKET_IN_COOKIE=False)
+    def test_login_merges_duplicate_products(self):
+        user1 = models.User.objects.create_user(
+            "user1@a.com", "pw432joij"
+        )
+        cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        basket = models.Basket.objects.create(user=user1)
+        models.BasketLine.objects.create(
+            basket=basket, product=cb, quantity=2
+        )
+        self.client.get(reverse("add_to_basket"), {"product_id": cb.id})
+        self.client.post(
+            reverse("login"),
+            {"email": "user1@a.com", "password": "pw432joij"},
+        )
+        self.assertEqual(models.Basket.objects.count(), 1)
+        line = models.BasketLine.objects.get()
+        self.assertEqual((line.basket_id, line.quantity), (basket.id, 3))
+        self.assertEqual(self.client.session["basket_id"], basket.id)
+
+    @override_settings(ANONYMOUS_BASKET_IN_COOKIE=False)
+    def test_basket_summary_is_cached_in_session(self):
+        cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        self.client.get(reverse("add_to_basket"), {"product_id": cb.id})
+        self.client.get(reverse("add_to_basket"), {"product_id": cb.id})
+
+        response = self.client.get(reverse("app-about"))
+        self.assertContains(response, "2 items in basket")
+        self.assertEqual(
+            self.client.session["basket_summary"]["total"], "20.00"
+        )
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("app-about"))
+        self.assertContains(response, "2 items in basket")
+        self.assertFalse(
+            any("main_basket" in q["sql"] for q in ctx.captured_queries)
+        )
+
+    @override_settings(ANONYMOUS_BASKET_IN_COOKIE=False)
+    def test_deleted_basket_is_dropped_from_session(self):
+        cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        self.client.get(reverse("add_to_basket"), {"product_id": cb.id})
+        models.Basket.objects.all().delete()
+
+        response = self.client.get(reverse("basket"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context["formset"])
+        self.assertNotIn("basket_id", self.client.session)
+
+    def test_anonymous_basket_is_kept_in_cookie(self):
+        cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        w = models.Product.objects.create(
+            name="Microsoft Windows guide",
+            slug="microsoft-windows-guide",
+            price=Decimal("12.00"),
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse("add_to_basket"), {"product_id": cb.id})
+            self.client.get(reverse("add_to_basket"), {"product_id": cb.id})
+            self.client.get(reverse("add_to_basket"), {"product_id": w.id})
+            response = self.client.get(reverse("app-about"))
+        self.assertContains(response, "3 items in basket")
+        self.assertFalse(
+            [q for q in ctx.captured_queries if not q["sql"].startswith("SELECT")]
+        )
+        self.assertFalse(models.Basket.objects.exists())
+
+        response = self.client.get(reverse("basket"))
+        formset = response.context["formset"]
+        self.assertEqual(
+            [form.instance.product for form in formset], [cb, w]
+        )
+        self.assertContains(response, "The cathedral and the bazaar")
+
+        response = self.client.post(reverse("basket"), {
+            "form-TOTAL_FORMS": 2,
+            "form-INITIAL_FORMS": 2,
+            "form-MIN_NUM_FORMS": 0,
+            "form-MAX_NUM_FORMS": 1000,
+            "form-0-product_id": cb.id,
+            "form-0-quantity": 1,
+            "form-1-product_id": w.id,
+            "form-1-quantity": 1,
+            "form-1-DELETE": "on",
+        })
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("app-about"))
+        self.assertContains(response, "1 items in basket")
+        self.assertFalse(models.Basket.objects.exists())
+
+    def test_add_to_basket_answers_json(self):
+        user1 = models.User.objects.create_user(
+            "user1@a.com", "pw432joij"
+        )
+        cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        for _ in range(2):
+            response = self.client.post(
+                reverse("add_to_basket"), {"product_id": cb.id}, HTTP_ACCEPT="application/json"
+            )
+        self.assertEqual(response.json(), {
+            "product_id": cb.id, "quantity": 2, "basket": {"count": 2, "total": "20.00"},
+        })
+
+        self.client.force_login(user1)
+        response = self.client.get(
+            reverse("add_to_basket"), {"product_id": cb.id}, HTTP_X_REQUESTED_WITH="XMLHttpRequest"
+        )
+        # The cookie basket is stored for the user first
+        self.assertEqual(response.json(), {
+            "product_id": cb.id, "quantity": 3, "basket": {"count": 3, "total": "30.00"},
+        })
+        response = self.client.get(reverse("add_to_basket"), {"product_id": cb.id})
+        self.assertRedirects(response, reverse("product", args=(cb.slug,)))
+        self.assertEqual(models.BasketLine.objects.get(basket__user=user1).quantity, 4)
+
+    def test_basket_api_reads_with_fixed_queries(self):
+        user1 = models.User.objects.create_user(
+            "user1@a.com", "pw432joij"
+        )
+        basket = models.Basket.objects.create(user=user1)
+        self.client.force_login(user1)
+        session = self.client.session
+        session["basket_id"] = basket.id
+        session.save()
+
+        query_counts = []
+        for i in range(3):
+            for j in range(i * 2 + 1):
+                product = models.Product.objects.create(
+                    name=f"Book {i}-{j}", slug=f"book-{i}-{j}", price=Decimal("2.00")
+                )
+                basket.add_product(product)
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse("basket_api"))
+            query_counts.append(len(ctx.captured_queries))
+
+        self.assertEqual(len(set(query_counts)), 1)
+        data = response.json()
+        self.assertEqual((data["count"], data["total"], len(data["lines"])), (9, "18.00", 9))
+        self.assertEqual(data["lines"][0], {
+            "product_id": models.Product.objects.get(slug="book-0-0").id,
+            "name": "Book 0-0",
+            "price": "2.00",
+            "url": reverse("product", args=("book-0-0",)),
+            "quantity": 1,
+        })
+
+    def test_basket_api_applies_line_changes(self):
+        cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        w = models.Product.objects.create(
+            name="Microsoft Windows guide",
+            slug="microsoft-windows-guide",
+            price=Decimal("12.00"),
+        )
+        for cookie in (True, False):
+            self.client.cookies.clear()
+            with self.settings(ANONYMOUS_BASKET_IN_COOKIE=cookie):
+                self.client.get(reverse("add_to_basket"), {"product_id": cb.id})
+                self.client.get(reverse("add_to_basket"), {"product_id": w.id})
+
+                response = self.client.patch(reverse("basket_api"), {"lines": [
+                    {"product_id": cb.id, "quantity": 3},
+                    {"product_id": w.id, "quantity": 0},
+                    {"product_id": 9999, "quantity": 1},
+                ]}, content_type="application/json")
+                self.assertEqual(response.status_code, 200)
+                data = response.json()
+                self.assertEqual((data["count"], data["total"]), (3, "30.00"))
+                self.assertEqual([line["product_id"] for line in data["lines"]], [cb.id])
+                self.assertEqual(data["not_found"], [9999])
+
+                response = self.client.get(reverse("basket_api"))
+                self.assertEqual(response.json()["lines"][0]["quantity"], 3)
+                self.assertEqual(models.Basket.objects.exists(), not cookie)
+
+        response = self.client.patch(reverse("basket_api"), {"lines": [
+            {"product_id": cb.id, "quantity": -1},
+        ]}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("quantity", response.json()["errors"]["0"])
+
+    def test_tampered_basket_cookie_is_dropped(self):
+        cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        self.client.get(reverse("add_to_basket"), {"product_id": cb.id})
+        self.client.cookies["basket"] = self.client.cookies["basket"].value + "x"
+
+        response = self.client.get(reverse("basket"))
+        self.assertIsNone(response.context["formset"])
+        self.assertEqual(response.cookies["basket"].value, "")
+
+    def test_cookie_basket_stored_at_checkout(self):
+        user1 = models.User.objects.create_user(
+            "user1@a.com", "pw432joij"
+        )
+        address = models.Address.objects.create(
+            user=user1,
+            name="John Kimball",
+            address1="127 Strudel road",
+            zip_code="MD13 6PD",
+            city="London",
+            country="uk",
+        )
+        cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        self.client.get(reverse("add_to_basket"), {"product_id": cb.id})
+        # Unlike a login through the login view, this doesn't merge the cookie basket
+        self.client.force_login(user1)
+
+        response = self.client.post(reverse("address_select"), {
+            "billing_address": address.id,
+            "shipping_address": address.id,
+        })
+        self.assertEqual(response.status_code, 302)
+        order = models.Order.objects.get(user=user1)
+        self.assertEqual(order.lines.count(), 1)
+        self.assertEqual(response.cookies["basket"].value, "")
+
+    def test_products_page_is_cached_until_catalog_changes(self):
+        cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        tag = cb.tags.create(name="Open source", slug="opensource")
+        url = reverse("products", kwargs={"tag": "opensource"})
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(list(response.context["object_list"]), [cb])
+        self.assertFalse(ctx.captured_queries)
+
+        w = models.Product.objects.create(
+            name="Linux kernel development",
+            slug="linux-kernel",
+            price=Decimal("12.00"),
+        )
+        w.tags.add(tag)
+        response = self.client.get(url)
+        self.assertEqual(list(response.context["object_list"]), [w, cb])
+
+        tag.product_set.remove(w)
+        response = self.client.get(url)
+        self.assertEqual(list(response.context["object_list"]), [cb])
+
+    def test_products_page_cache_key_uses_page_number(self):
+        models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        url = reverse("products", kwargs={"tag": "all"})
+        self.client.get(url, {"page": "1"})
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {"page": "001"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(ctx.captured_queries)
+
+        response = self.client.get(url, {"page": "one"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_products_page_invalidated_by_admin_actions(self):
+        cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        url = reverse("products", kwargs={"tag": "all"})
+        response = self.client.get(url)
+        self.assertEqual(list(response.context["object_list"]), [cb])
+
+        user = models.User.objects.create_superuser("admin@a.com", "pw432joij")
+        self.client.force_login(user)
+        self.client.post(
+            reverse("admin:main_product_changelist"),
+            {"action": "make_inactive", "_selected_action": [cb.id]},
+        )
+        response = self.client.get(url)
+        self.assertEqual(list(response.context["object_list"]), [])
+
+    def test_products_page_invalidated_by_filtered_admin_actions(self):
+        cb = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        cb.tags.create(name="Open source", slug="opensource")
+        url = reverse("products", kwargs={"tag": "opensource"})
+        response = self.client.get(url)
+        self.assertEqual(list(response.context["object_list"]), [cb])
+
+        user = models.User.objects.create_superuser("admin@a.com", "pw432joij")
+        self.client.force_login(user)
+        self.client.post(
+            reverse("admin:main_product_changelist") + "?active__exact=1",
+            {"action": "make_inactive", "_selected_action": [cb.id]},
+        )
+        response = self.client.get(url)
+        self.assertEqual(list(response.context["object_list"]), [])
+
+    def test_products_page_unknown_tag(self):
+        response = self.client.get(
+            reverse("products", kwargs={"tag": "nothing"})
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_order_dashboard_filters_by_customer_email(self):
+        staff = models.User.objects.create_user("staff@a.com", "pw432joij", is_staff=True)
+        alice = models.User.objects.create_user("Alice.Smith@a.com", "pw432joij")
+        alan = models.User.objects.create_user("alan@b.com", "pw432joij")
+        alice_order = models.Order.objects.create(user=alice)
+        alan_order = models.Order.objects.create(user=alan)
+        self.assertEqual(alice.email_lookup, "alice.smith@a.com")
+
+        self.client.force_login(staff)
+        url = reverse("order-dashboard")
+        for value, expected in (
+            ("alice.smith@A.com", [alice_order]),
+            ("al", [alice_order, alan_order]),
+            ("ALA", [alan_order]),
+            ("lice", []),
+        ):
+            response = self.client.get(url, {"customer_email": value})
+            self.assertEqual(
+                sorted(response.context["filter"].qs, key=lambda o: o.id), expected
+            )
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_product_page_is_prefetched_and_cached(self):
+        product = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        url = reverse("product", kwargs={"slug": product.slug})
+
+        def add_image():
+            with open("main/fixtures/cathedral-bazaar.jpg", "rb") as f:
+                models.ProductImage.objects.create(product=product, image=ImageFile(f, name="cb.jpg"))
+
+        add_image()
+        product.tags.create(name="Open source", slug="opensource")
+        with CaptureQueriesContext(connection) as miss:
+            response = self.client.get(url)
+        self.assertContains(response, "Open source")
+        self.assertContains(response, "cb")
+
+        # More images and tags don't add queries, and a cached page only reads the product
+        add_image()
+        tag = product.tags.create(name="Essays", slug="essays")
+        with CaptureQueriesContext(connection) as miss_again:
+            response = self.client.get(url)
+        self.assertEqual(len(miss_again), len(miss))
+        self.assertEqual(len(response.context["product_page"]["images"]), 2)
+        with self.assertNumQueries(len(miss) - 2):
+            self.client.get(url)
+
+        tag.name = "Manifestos"
+        tag.save()
+        self.assertContains(self.client.get(url), "Manifestos")
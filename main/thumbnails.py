@@ -0,0 +1,153 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+import logging
+import os
+
+from PIL import Image
+
+from . import catalog_cache
+from .models import ProductImage, ProductImageRendition
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+def render(image, size, image_format):
+    """Resize a decoded PIL image to fit in size and encode it in image_format.
+        Returns the encoded bytes and the final (width, height)"""
+    rendition = image.copy()
+    rendition.thumbnail(size, Image.LANCZOS)
+
+    output = BytesIO()
+    rendition.save(output, image_format)
+    return output.getvalue(), rendition.size
+
+def render_file(path, renditions):
+    """Decode the image at path once and render every rendition spec in the
+        renditions dict. Doesn't touch Django, so it can run in a process pool"""
+    with Image.open(path) as image:
+        original = image.convert("RGB")
+    return {
+        name: render(original, spec["size"], spec["format"])
+        for name, spec in renditions.items()
+    }
+
+def build_renditions(image_name, rendered):
+    """Write the rendered files to storage and return the unsaved
+        ProductImageRendition instances for them"""
+    basename = os.path.splitext(os.path.basename(image_name))[0]
+    renditions = []
+    for name, (data, (width, height)) in rendered.items():
+        image_format = settings.THUMBNAIL_RENDITIONS[name]["format"]
+        rendition = ProductImageRendition(name=name, width=width, height=height)
+        rendition.file.save(f"{basename}-{name}.{EXTENSIONS[image_format]}", ContentFile(data), save=False)
+        renditions.append(rendition)
+    return renditions
+
+def default_rendition(renditions):
+    return next(r for r in renditions if r.name == settings.THUMBNAIL_DEFAULT_RENDITION)
+
+def generate_renditions(product_image):
+    """Store every rendition configured in settings.THUMBNAIL_RENDITIONS for the
+        image. The THUMBNAIL_DEFAULT_RENDITION one also becomes the thumbnail"""
+    product_image.image.open("rb")
+    try:
+        rendered = render_file(product_image.image, settings.THUMBNAIL_RENDITIONS)
+    finally:
+        product_image.image.close()
+
+    renditions = build_renditions(product_image.image.name, rendered)
+    for rendition in renditions:
+        rendition.image = product_image
+
+    with transaction.atomic():
+        product_image.renditions.all().delete()
+        ProductImageRendition.objects.bulk_create(renditions)
+        ProductImage.objects.filter(pk=product_image.pk).update(
+            thumbnail=default_rendition(renditions).file.name,
+            thumbnail_status=ProductImage.READY,
+        )
+    # The update skips the post_save receivers, the product page shows the thumbnails
+    catalog_cache.invalidate_product_pages([product_image.product_id])
+
+def claimable():
+    """The pending images, and the ones a worker claimed more than
+        THUMBNAIL_CLAIM_LEASE seconds ago without finishing, as it died"""
+    expired = timezone.now() - timedelta(seconds=settings.THUMBNAIL_CLAIM_LEASE)
+    return ProductImage.objects.filter(
+        Q(thumbnail_status=ProductImage.PENDING)
+        | Q(thumbnail_status=ProductImage.PROCESSING, thumbnail_claimed__lt=expired)
+        | Q(thumbnail_status=ProductImage.PROCESSING, thumbnail_claimed__isnull=True)
+    )
+
+def claim(image_id):
+    """Move a claimable image to processing. Returns False if another worker got it first"""
+    return claimable().filter(pk=image_id).update(
+        thumbnail_status=ProductImage.PROCESSING, thumbnail_claimed=timezone.now()
+    ) == 1
+
+def claim_batch(limit=None):
+    """Move up to limit claimable images to processing in one transaction and
+        return their ids. Rows locked by another worker's claim are skipped
+        instead of waited on, which needs SELECT ... FOR UPDATE SKIP LOCKED
+        (PostgreSQL)"""
+    with transaction.atomic():
+        pending = claimable().select_for_update(skip_locked=True).order_by("pk")
+        image_ids = list(pending.values_list("pk", flat=True)[:limit])
+        ProductImage.objects.filter(pk__in=image_ids).update(
+            thumbnail_status=ProductImage.PROCESSING, thumbnail_claimed=timezone.now()
+        )
+    return image_ids
+
+def process_image(image_id, claimed=False):
+    """Claim and process a single image, recording a failure on the image.
+        claimed tells the image was already claimed by claim_batch()"""
+    if not claimed and not claim(image_id):
+        return False
+
+    product_image = ProductImage.objects.get(pk=image_id)
+    logger.info(f"Generating renditions for image {image_id}")
+    try:
+        generate_renditions(product_image)
+    except Exception:
+        logger.exception(f"Generating renditions for image {image_id} failed")
+        ProductImage.objects.filter(pk=image_id).update(thumbnail_status=ProductImage.FAILED)
+        return False
+    return True
+
+def _process_in_thread(image_id, claimed):
+    try:
+        return process_image(image_id, claimed)
+    finally:
+        connection.close()
+
+def process_pending(concurrency=None, limit=None):
+    """Process the images waiting for renditions, up to limit of them. With a
+        concurrency above 1 the images are processed by a pool of threads, each
+        one with its own database connection. Returns the number processed"""
+    if concurrency is None:
+        concurrency = settings.THUMBNAIL_WORKER_CONCURRENCY
+
+    close_old_connections()
+    # Without SKIP LOCKED the images are claimed one at a time as they are processed
+    claimed = connection.features.has_select_for_update_skip_locked
+    if claimed:
+        image_ids = claim_batch(limit or None)
+    else:
+        image_ids = claimable().order_by("pk").values_list("pk", flat=True)
+        if limit:
+            image_ids = image_ids[:limit]
+        image_ids = list(image_ids)
+
+    if concurrency <= 1:
+        return sum(process_image(image_id, claimed) for image_id in image_ids)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return sum(executor.map(_process_in_thread, image_ids, [claimed] * len(image_ids)))
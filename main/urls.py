@@ -1,5 +1,4 @@
 from django.urls import path, include
-from django.views.generic.detail import DetailView
 from django.contrib.auth import views as auth_views
 from django.views.generic.base import TemplateView
 
@@ -10,11 +9,14 @@ from .views import (home,
 
                     add_to_basket,
                     manage_basket,
+                    basket_api,
                     
                     ContactFormView,
                     SignupView,
                     
                     ProductListView,
+                    ProductDetailView,
+                    ProductSearchView,
                     
                     AddressCreateView,
                     AddressDeleteView,
@@ -23,15 +25,15 @@ from .views import (home,
                     AddressSelectionView,
                     
                     OrderView)
-from .models import Product
 from .forms import AuthenticationForm
-from .endpoints import PaidOrderLineViewSet, PaidOrderViewSet
+from .endpoints import ChangeFeedViewSet, PaidOrderLineViewSet, PaidOrderViewSet
 from main import admin
 
 
 router = routers.DefaultRouter()
 router.register(r'orderlines', PaidOrderLineViewSet)
 router.register(r'orders', PaidOrderViewSet)
+router.register(r'changes', ChangeFeedViewSet)
 
 urlpatterns = [
     path('',home, name = 'app-home'),
@@ -39,7 +41,8 @@ urlpatterns = [
     path('contact_us/', ContactFormView.as_view(), name='contact-us'),
 
     path('products/<slug:tag>/', ProductListView.as_view(), name='products'),
-    path('product/<slug:slug>/', DetailView.as_view(model=Product), name='product'),
+    path('product/<slug:slug>/', ProductDetailView.as_view(), name='product'),
+    path('search/', ProductSearchView.as_view(), name='search'),
 
     path('signup/', SignupView.as_view(), name='sign-up'),
     path('login/', auth_views.LoginView.as_view(template_name="main/login.html",form_class=AuthenticationForm), name="login"),
@@ -52,6 +55,7 @@ urlpatterns = [
 
     path("add_to_basket/", add_to_basket, name='add_to_basket'),
     path("basket/", manage_basket, name="basket"),
+    path("api/basket/", basket_api, name="basket_api"),
 
     path("order/done/", TemplateView.as_view(template_name="main/order_done.html"), name="checkout_done"),
     path("order/address_select/", AddressSelectionView.as_view(), name="address_select"),
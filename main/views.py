@@ -1,20 +1,33 @@
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, JsonResponse
+from django.core.paginator import Page
 from django.urls import reverse, reverse_lazy
+from django.views.decorators.http import require_http_methods
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import FormView
+from django.views.generic.detail import DetailView
+from django.template.loader import render_to_string
 from django.views.generic.list import ListView
 from django.contrib.auth import login, authenticate
 from django.contrib import messages
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
 from django import forms
-from django.db import models as django_models
+from django.db import models as django_models, transaction
+from django.db.models import prefetch_related_objects
 import django_filters
 from django_filters.views import FilterView
 
 from main import forms as user_forms
 from main import models
-
+from main import catalog_cache
+from main import search
+from main.baskets import CookieBasket
+from main.middlewares import reset_basket_summary
+from main.db_router import replica_view
+from django.utils.decorators import method_decorator
+
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,10 +36,23 @@ class DateInput(forms.DateInput):
     input_type = 'date'
 
 class OrderFilter(django_filters.FilterSet):
+    customer_email = django_filters.CharFilter(label="Customer email", method="filter_customer_email")
+
+    def filter_customer_email(self, queryset, name, value):
+        """A full address matches exactly, anything else as a prefix. Both use
+            the index of the lowercased email, unlike icontains"""
+        value = value.strip().lower()
+        if not value:
+            return queryset
+        if "@" in value:
+            return queryset.filter(user__email_lookup=value)
+        # The column is lowercased already, istartswith would wrap it in UPPER()
+        # and miss the varchar_pattern_ops index PostgreSQL has for LIKE
+        return queryset.filter(user__email_lookup__startswith=value)
+
     class Meta:
         model = models.Order
         fields = {
-            'user__email':['icontains'],
             'status':['exact'],
             'date_updated': ['gt','lt'],
             'date_added': ['gt','lt'],
@@ -40,6 +66,7 @@ class OrderFilter(django_filters.FilterSet):
             }
         }
 
+@method_decorator(replica_view, name="dispatch")
 class OrderView(UserPassesTestMixin, FilterView):
     """OrderView is a view that is only available to users that have access to
         the admin interface as well, as the test_func function checks for that."""
@@ -89,23 +116,122 @@ class SignupView(FormView):
         return response
 
 class ProductListView(ListView):
+    """Listing pages are served from the catalog cache, so a hit on a cached
+        page runs neither the product query nor the COUNT for the paginator"""
     template_name = "main/product_list.html"
     paginate_by = 4
 
     def get_queryset(self):
         tag = self.kwargs['tag'] # This comes from the URL <slug:tag>. We would use a self.request.GET if we put it as a filter parameter or as a form
-        self.tag = None
-        
+        products = models.Product.objects.active()
+
         if tag != 'all':
-            self.tag = get_object_or_404(models.ProductTag,slug=tag)
+            products = products.filter(tags__slug = tag)
 
-        if self.tag:
-            products = models.Product.objects.active().filter(tags = self.tag)
-        else:
-            products = models.Product.objects.active()
-        
         return products.order_by("name")
 
+    def paginate_queryset(self, queryset, page_size):
+        tag = self.kwargs['tag']
+        page_number = self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg) or 1
+        # Normalised before it goes in the cache key, so "2" and "002" share an entry
+        if page_number != 'last':
+            try:
+                page_number = int(page_number)
+            except ValueError:
+                raise Http404("Invalid page")
+
+        def build():
+            if tag != 'all' and not models.ProductTag.objects.filter(slug=tag).exists():
+                raise Http404("No tag found matching the query")
+
+            paginator, page, object_list, is_paginated = super(ProductListView, self).paginate_queryset(queryset, page_size)
+            return {"count": paginator.count, "number": page.number, "object_list": list(object_list)}
+
+        cached = catalog_cache.get_listing_page(tag, page_number, build)
+
+        paginator = self.get_paginator(queryset, page_size, orphans=self.get_paginate_orphans(),
+                                       allow_empty_first_page=self.get_allow_empty())
+        paginator.count = cached["count"]
+        page = Page(cached["object_list"], cached["number"], paginator)
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+
+
+class ProductDetailView(DetailView):
+    """Only the product is queried on a cached page. The rendered product table
+        and the image payload of the image switcher are cached per product by
+        catalog_cache until the product, its tags or its images change"""
+    model = models.Product
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["product_page"] = catalog_cache.get_product_page(self.object.id, self.build_page)
+        return context
+
+    def build_page(self):
+        product = self.object
+        prefetch_related_objects([product], "tags", "productimage_set")
+        return {
+            "body": render_to_string("main/product_detail_body.html", {"object": product}),
+            "images": [
+                {"image": image.image.url, "thumbnail": image.thumbnail_url}
+                for image in product.productimage_set.all()
+            ],
+        }
+
+
+class ProductSearchView(ListView):
+    """Ranked full-text search over the active products. The search backend
+        returns only the ids of the requested page and the number of matches"""
+    template_name = "main/product_search.html"
+    paginate_by = 10
+
+    def get_queryset(self):
+        self.query = self.request.GET.get("q", "").strip()
+        return models.Product.objects.active()
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_paginator([], page_size)
+        try:
+            page_number = int(self.request.GET.get(self.page_kwarg) or 1)
+        except ValueError:
+            raise Http404("Invalid page")
+
+        offset = (page_number - 1) * page_size
+        result = search.get_backend().search(self.query, offset, page_size)
+        paginator.count = result.total
+        if page_number < 1 or (page_number > 1 and offset >= result.total):
+            raise Http404("Invalid page")
+
+        products = queryset.in_bulk(result.ids)
+        page = Page([products[i] for i in result.ids if i in products], page_number, paginator)
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["query"] = self.query
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.GET.get("format") != "json":
+            return super().render_to_response(context, **response_kwargs)
+
+        page = context["page_obj"]
+        return JsonResponse({
+            "query": self.query,
+            "count": page.paginator.count,
+            "page": page.number,
+            "results": [
+                {
+                    "id": product.id,
+                    "name": product.name,
+                    "slug": product.slug,
+                    "price": str(product.price),
+                    "url": reverse("product", args=(product.slug,)),
+                }
+                for product in page.object_list
+            ],
+        })
 
 
 class AddressListView(LoginRequiredMixin, ListView):
@@ -155,34 +281,64 @@ class AddressSelectionView(LoginRequiredMixin, FormView):
 
     def form_valid(self, form):
         """Once the order is submitted, delete the basket and create the order"""
-        del self.request.session['basket_id']
         basket = self.request.basket
+        if isinstance(basket, CookieBasket):
+            # Login merges the cookie basket, unless it was filled after logging in
+            basket = basket.to_basket(self.request.user)
+        else:
+            del self.request.session['basket_id']
+        reset_basket_summary(self.request)
         basket.create_order(form.cleaned_data['shipping_address'],
                             form.cleaned_data['billing_address'])
         return super().form_valid(form)
 
+def wants_json(request):
+    """XHR and fetch() clients asking for JSON instead of a page"""
+    return request.is_ajax() or "application/json" in request.META.get("HTTP_ACCEPT", "")
+
 def add_to_basket(request):
-    """Create the basket and basketline with the products and redirect to the product page after adding
+    """Add one product to the basket and redirect to the product page after adding
         If the basket does not exist create it
-        Add the basket id to the session"""
-    product = get_object_or_404(models.Product, pk=request.GET.get("product_id"))
+        Add the basket id to the session
+        With ANONYMOUS_BASKET_IN_COOKIE anonymous visitors get a cookie basket instead.
+        Clients asking for JSON get the quantity of the product and the basket
+        summary instead of the redirect"""
+    product = get_object_or_404(
+        models.Product, pk=request.POST.get("product_id") or request.GET.get("product_id")
+    )
     basket = request.basket
 
-    if not request.basket:
-        if request.user.is_authenticated:
-            user = request.user
-        else:
-            user = None
-    
-        basket = models.Basket.objects.create(user=user)
+    if isinstance(basket, CookieBasket) and request.user.is_authenticated:
+        # Filled before a login that didn't merge it, like the one after signing up
+        basket = basket.to_basket(request.user)
         request.session['basket_id'] = basket.id
 
-    basketline, created = models.BasketLine.objects.get_or_create(basket=basket, product=product)
+    if isinstance(basket, CookieBasket) or (
+        not basket and settings.ANONYMOUS_BASKET_IN_COOKIE and not request.user.is_authenticated
+    ):
+        if not isinstance(basket, CookieBasket):
+            basket = CookieBasket(request)
+        if not basket.add(product):
+            error = "Your basket is full, please login to add more products."
+            if wants_json(request):
+                return JsonResponse({"error": error, "basket": basket.summary()}, status=409)
+            messages.warning(request, error)
+        quantity = basket.quantities.get(product.id, 0)
+    else:
+        if not basket:
+            if request.user.is_authenticated:
+                user = request.user
+            else:
+                user = None
 
-    if not created:
-        basketline.quantity += 1
-        basketline.save()
-    
+            basket = models.Basket.objects.create(user=user)
+            request.session['basket_id'] = basket.id
+
+        quantity = basket.add_product(product)
+        reset_basket_summary(request)
+
+    if wants_json(request):
+        return JsonResponse({"product_id": product.id, "quantity": quantity, "basket": basket.summary()})
     return HttpResponseRedirect(reverse("product", args = (product.slug,)))
 
 
@@ -190,16 +346,25 @@ def manage_basket(request):
     """View to render the formset to add products to basket. Returns None to the view if there is no products"""
     if not request.basket:
         return render(request, "main/basket.html", {"formset":None})
+
+    if isinstance(request.basket, CookieBasket):
+        formset_class = user_forms.CookieBasketLineFormset
+    else:
+        formset_class = user_forms.BasketLineFormset
     
     if request.method == "POST":
-        formset = user_forms.BasketLineFormset(
+        formset = formset_class(
             request.POST, instance = request.basket
         )
 
         if formset.is_valid():
-            formset.save()
+            # The lines are saved one at a time, the totals are updated once
+            with transaction.atomic(), models.deferred_basket_totals():
+                formset.save()
+            request.basket.refresh_totals()
+            reset_basket_summary(request)
     else:
-        formset = user_forms.BasketLineFormset(
+        formset = formset_class(
             instance = request.basket
         )
     
@@ -208,3 +373,53 @@ def manage_basket(request):
     
     return render(request, "main/basket.html", {"formset":formset})
 
+
+def basket_json(basket):
+    """The lines of the basket with their products, and its totals"""
+    if not basket:
+        return {"lines": [], "count": 0, "total": "0.00"}
+
+    if isinstance(basket, CookieBasket):
+        lines = basket.lines()
+    else:
+        lines = basket.basketline_set.select_related("product").order_by("pk")
+    return dict(basket.summary(), lines=[
+        {
+            "product_id": line.product.id,
+            "name": line.product.name,
+            "price": str(line.product.price),
+            "url": reverse("product", args=(line.product.slug,)),
+            "quantity": line.quantity,
+        }
+        for line in lines
+    ])
+
+@require_http_methods(["GET", "PATCH", "POST"])
+def basket_api(request):
+    """The basket as JSON, read with a fixed number of queries.
+        PATCH (or POST) {"lines": [{"product_id": 3, "quantity": 2}, ...]} changes
+        the quantities of lines in one transaction, a quantity of 0 removing the
+        line. The answer is the updated basket, with the products that have no
+        line in the basket listed in "not_found" """
+    basket = request.basket
+    if request.method == "GET":
+        return JsonResponse(basket_json(basket))
+
+    try:
+        changes = json.loads(request.body)["lines"]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": 'Expected a JSON object with a "lines" list.'}, status=400)
+    if not isinstance(changes, list) or len(changes) > 1000 or not all(isinstance(c, dict) for c in changes):
+        return JsonResponse({"error": '"lines" must be a list of at most 1000 objects.'}, status=400)
+
+    line_forms = [user_forms.BasketLineChangeForm(change) for change in changes]
+    errors = {i: form.errors for i, form in enumerate(line_forms) if not form.is_valid()}
+    if errors:
+        return JsonResponse({"errors": errors}, status=400)
+
+    # A product given twice gets its last quantity
+    quantities = {form.cleaned_data["product_id"]: form.cleaned_data["quantity"] for form in line_forms}
+    found = basket.set_quantities(quantities) if basket else set()
+    reset_basket_summary(request)
+
+    return JsonResponse(dict(basket_json(basket), not_found=sorted(set(quantities) - found)))